@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from random import randint
+
+from site_client import (
+    get_breaker,
+    get_limiter,
+    report_failure,
+    report_response,
+)
+
+
+class AsyncTrackingEngine:
+    """
+    Движок отслеживания на asyncio: каждый маршрут - корутина в одном
+    event loop, запросы на сайт через aiohttp, сообщения через AsyncTeleBot.
+    Работа с БД и разбор страниц остаются синхронными и выполняются
+    в небольшом пуле потоков (те же таблицы tracking / trains / routes).
+
+    hooks - объект с синхронными функциями из main.py:
+        list_routes() -> URL маршрутов, которые обслуживает этот движок
+        make_state(url) -> объект состояния маршрута
+        load_rows(state) -> активные отслеживания маршрута
+        headers(state) -> заголовки запроса
+        cached(url) -> свежая страница из общего кэша или None
+        store(url, status, body, headers) -> сохранить ответ в кэш
+        on_response(state, rows, status, body, headers, notify) -> задержка
+        on_failure(state, rows, error, notify) -> задержка
+    body в store и on_response - байты ответа без декодирования.
+    notify(chat_id, text, reply_markup=None) собирает сообщения, которые
+    затем отправляются асинхронно.
+
+    start() возвращает False, если движок не запустился (нет aiohttp,
+    ошибка или таймаут запуска); on_stop() вызывается, если движок
+    не запустился или остановился - маршруты надо отдать другому движку.
+    """
+
+    def __init__(
+        self,
+        token,
+        hooks,
+        concurrency=50,
+        executor_workers=4,
+        sync_interval=300,
+        request_timeout=30,
+        on_stop=None,
+    ):
+        self.token = token
+        self.hooks = hooks
+        self.concurrency = concurrency
+        self.executor_workers = executor_workers
+        self.sync_interval = sync_interval
+        self.request_timeout = request_timeout
+        self.on_stop = on_stop
+        self.running = False
+        self._loop = None
+        self._tasks = {}  # url -> asyncio.Task
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    # Запуск event loop в отдельном потоке (Flask/gunicorn остаются как есть)
+    # True - движок работает
+    def start(self, timeout=10):
+        with self._start_lock:
+            if self._started:
+                return self.running
+            self._started = True
+        ready = threading.Event()
+        threading.Thread(
+            target=self._run, args=(ready,), name="async_engine", daemon=True
+        ).start()
+        if not ready.wait(timeout=timeout):
+            logging.error(f"Async engine не запустился за {timeout} сек")
+        return self.running
+
+    # Добавить маршрут из любого потока (например, из обработчика бота)
+    def add_route(self, url, delay=None):
+        if self._loop is None:
+            logging.warning(f"Async engine не запущен, маршрут {url} отложен")
+            return
+        self._loop.call_soon_threadsafe(self._ensure_task, url, delay)
+
+    def stats(self):
+        return {
+            "routes": len(self._tasks),
+            "started": self._started,
+            "running": self.running,
+        }
+
+    def _run(self, ready):
+        try:
+            asyncio.run(self._main(ready))
+        except Exception as e:
+            logging.error(f"Async engine остановлен: {e}", exc_info=True)
+        finally:
+            self.running = False
+            self._loop = None
+            ready.set()
+            if self.on_stop is not None:
+                self.on_stop()
+
+    async def _main(self, ready):
+        # Необязательные зависимости импортируются только для этого движка
+        import aiohttp
+        from telebot.async_telebot import AsyncTeleBot
+
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.executor_workers, thread_name_prefix="async_db"
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._bot = AsyncTeleBot(self.token)
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(
+            timeout=timeout, connector=connector
+        ) as session:
+            self._session = session
+            self.running = True
+            ready.set()
+            logging.info("Async engine запущен")
+            try:
+                await self._sync_loop()
+            finally:
+                await self._bot.close_session()
+                self._executor.shutdown(wait=False)
+
+    # Выполнить синхронную функцию (БД, разбор страницы) в пуле потоков
+    async def _run_sync(self, func, *args):
+        return await self._loop.run_in_executor(self._executor, func, *args)
+
+    # Периодическая сверка корутин маршрутов с таблицей tracking
+    async def _sync_loop(self):
+        while True:
+            try:
+                urls = await self._run_sync(self.hooks.list_routes)
+                for url in urls:
+                    # Разнести первые запросы, чтобы не опрашивать всё разом
+                    self._ensure_task(url, randint(0, 60))
+                logging.info(f"Async engine: {self.stats()}")
+            except Exception as e:
+                logging.error(f"Async engine sync error: {e}", exc_info=True)
+            await asyncio.sleep(self.sync_interval)
+
+    def _ensure_task(self, url, delay=None):
+        if url in self._tasks:
+            return
+        if delay is None:
+            delay = randint(600, 800)
+        self._tasks[url] = asyncio.create_task(
+            self._route_task(url, delay), name=f"route {url}"
+        )
+
+    # Корутина опроса одного маршрута для всех его отслеживаний
+    async def _route_task(self, url, delay):
+        state = self.hooks.make_state(url)
+        try:
+            while delay is not None:
+                await asyncio.sleep(delay)
+                delay = await self._poll(state)
+        except Exception as e:
+            logging.error(
+                f"Async route task {url} crashed: {e}", exc_info=True
+            )
+        finally:
+            self._tasks.pop(url, None)
+
+    async def _poll(self, state):
+        rows = await self._run_sync(self.hooks.load_rows, state)
+        if not rows:
+            logging.info(f"Нет отслеживаний для маршрута {state.url}")
+            return None
+
+        outbox = []
+
+        def notify(chat_id, text, reply_markup=None):
+            outbox.append((chat_id, text, reply_markup))
+
+        try:
+            page = self.hooks.cached(state.url)
+            if page is not None:
+                status, body, resp_headers = (
+                    page.status_code,
+                    page.content,
+                    page.headers,
+                )
+            else:
+                status, body, resp_headers = await self._fetch(state)
+                self.hooks.store(state.url, status, body, resp_headers)
+        except Exception as e:
+            delay = await self._run_sync(
+                self.hooks.on_failure, state, rows, e, notify
+            )
+        else:
+            delay = await self._run_sync(
+                self.hooks.on_response,
+                state,
+                rows,
+                status,
+                body,
+                resp_headers,
+                notify,
+            )
+        await self._send(outbox)
+        return delay
+
+    async def _fetch(self, state):
+        headers = dict(self.hooks.headers(state))
+        # aiohttp сам выбирает поддерживаемые алгоритмы сжатия
+        headers.pop("Accept-Encoding", None)
+        async with self._semaphore:
+            # Общие с потоками предохранитель и ограничитель частоты
+            # запросов. Место в очереди занимается только после получения
+            # слота семафора: ждущие семафор задачи его не держат
+            get_breaker(state.url).allow()
+            await asyncio.sleep(get_limiter(state.url).reserve())
+            try:
+                async with self._session.get(
+                    state.url, headers=headers
+                ) as resp:
+                    # Байты как есть: ни декодирования, ни определения
+                    # кодировки (разбор - в пуле потоков)
+                    body = await resp.read()
+            except Exception:
+                report_failure(state.url)
+                raise
+            report_response(state.url, resp.status)
+            return resp.status, body, resp.headers
+
+    async def _send(self, outbox):
+        for chat_id, text, reply_markup in outbox:
+            try:
+                await self._bot.send_message(
+                    chat_id, text, reply_markup=reply_markup
+                )
+            except Exception as e:
+                logging.warning(f"Async send to {chat_id} failed: {e}")
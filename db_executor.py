@@ -0,0 +1,152 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class DbCallTimeout(TimeoutError):
+    """Результат запроса к БД не получен за timeout"""
+
+
+class DbExecutor:
+    """
+    Выполнение функций обращения к БД в нескольких потоках (workers).
+    Задачи с одинаковым order_key (например, chat_id) выполняются строго
+    по очереди в порядке добавления, остальные - параллельно.
+    call() ждёт результат не дольше timeout; задача, не успевшая начаться,
+    отменяется. stats() - длина очереди, ожидание в очереди и время
+    выполнения.
+    """
+
+    def __init__(self, workers=4, timeout=60):
+        self.workers = workers
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._chains = {}  # order_key -> задачи, ждущие предыдущую
+        self._threads = []
+        # Метрики
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._run_max = 0.0
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"db-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    # Поставить задачу в очередь; результат - Future
+    def submit(self, func, *args, order_key=None, **kwargs):
+        future = Future()
+        task = (func, args, kwargs, future, order_key, time.monotonic())
+        with self._lock:
+            self._submitted += 1
+            if order_key is not None:
+                chain = self._chains.get(order_key)
+                if chain is not None:
+                    # Предыдущая задача того же ключа ещё не завершена
+                    chain.append(task)
+                    return future
+                self._chains[order_key] = deque()
+        self._queue.put(task)
+        return future
+
+    # Выполнить функцию и дождаться результата (исключение пробрасывается)
+    def call(self, func, *args, order_key=None, timeout=None, **kwargs):
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(func, *args, order_key=order_key, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timeouts += 1
+            raise DbCallTimeout(
+                f"{func.__name__}: нет ответа БД за {timeout} сек"
+            ) from None
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            try:
+                self._run(task)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, task):
+        func, args, kwargs, future, order_key, enqueued = task
+        try:
+            # Отменённая (по timeout) задача не выполняется
+            if not future.set_running_or_notify_cancel():
+                with self._lock:
+                    self._cancelled += 1
+                return
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                logging.error(f"Ошибка в db_worker ({func.__name__}): {e}")
+                future.set_exception(e)
+                failed = True
+            else:
+                future.set_result(result)
+                failed = False
+            finished = time.monotonic()
+            with self._lock:
+                wait = started - enqueued
+                run = finished - started
+                self._completed += 1
+                self._failed += failed
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                self._run_total += run
+                self._run_max = max(self._run_max, run)
+        finally:
+            if order_key is not None:
+                self._release(order_key)
+
+    # Следующая задача того же order_key - в общую очередь
+    def _release(self, order_key):
+        with self._lock:
+            chain = self._chains.get(order_key)
+            if chain:
+                self._queue.put(chain.popleft())
+            else:
+                self._chains.pop(order_key, None)
+
+    def stats(self):
+        with self._lock:
+            done = self._completed
+            return {
+                "workers": self.workers,
+                "queue_depth": self._queue.qsize()
+                + sum(len(chain) for chain in self._chains.values()),
+                "ordered_keys": len(self._chains),
+                "submitted": self._submitted,
+                "completed": done,
+                "failed": self._failed,
+                "cancelled": self._cancelled,
+                "timeouts": self._timeouts,
+                "wait_avg_ms": (
+                    round(self._wait_total / done * 1000, 2) if done else 0.0
+                ),
+                "wait_max_ms": round(self._wait_max * 1000, 2),
+                "run_avg_ms": (
+                    round(self._run_total / done * 1000, 2) if done else 0.0
+                ),
+                "run_max_ms": round(self._run_max * 1000, 2),
+            }
@@ -0,0 +1,220 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+
+class PoolTimeout(PoolError):
+    """Все соединения заняты дольше timeout"""
+
+
+class DbPool:
+    """
+    Пул соединений PostgreSQL, безопасный для нескольких потоков.
+    Не больше maxconn соединений: при исчерпании getconn ждёт
+    освобождения соединения не дольше timeout и выдаёт PoolTimeout.
+    Перед выдачей соединение проверяется: закрытое или старше max_age
+    пересоздаётся, простаивавшее дольше check_idle проверяется SELECT 1.
+    stats() - занятые и свободные соединения, время ожидания.
+    """
+
+    def __init__(
+        self,
+        minconn=1,
+        maxconn=10,
+        timeout=30,
+        max_age=3600,
+        check_idle=60,
+        **connect_kwargs,
+    ):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_age = max_age
+        self.check_idle = check_idle
+        self._connect_kwargs = connect_kwargs
+        self._cond = threading.Condition()
+        self._idle = []  # (соединение, время возврата в пул)
+        self._in_use = set()
+        self._born = {}  # id соединения -> время создания
+        self._size = 0  # открытые соединения и создаваемые сейчас
+        self._closed = False
+        # Метрики
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._broken = 0
+        self._in_use_max = 0
+        for _ in range(minconn):
+            with self._cond:
+                self._size += 1
+            conn = self._connect()
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+
+    # Новое соединение (место в self._size уже занято)
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(**self._connect_kwargs)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created += 1
+            self._born[id(conn)] = time.monotonic()
+        return conn
+
+    # Закрытие соединения и освобождение места в пуле
+    def _discard(self, conn):
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception as e:
+            logging.debug(f"Ошибка закрытия соединения пула: {e}")
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._size -= 1
+            self._cond.notify()
+
+    # Годно ли соединение из пула к выдаче
+    def _usable(self, conn, idle_since):
+        if conn.closed:
+            with self._cond:
+                self._broken += 1
+            return False
+        born = self._born.get(id(conn), idle_since)
+        if self.max_age and time.monotonic() - born > self.max_age:
+            with self._cond:
+                self._recycled += 1
+            return False
+        if time.monotonic() - idle_since < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logging.warning(f"Соединение пула БД не отвечает: {e}")
+            with self._cond:
+                self._broken += 1
+            return False
+
+    # Соединение из пула: ожидание не дольше timeout
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+        while True:
+            conn = idle_since = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("Пул соединений закрыт")
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"Нет свободного соединения с БД за {timeout} сек"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+            if conn is None:
+                conn = self._connect()
+            elif not self._usable(conn, idle_since):
+                self._discard(conn)
+                continue
+            break
+        wait = time.monotonic() - start
+        with self._cond:
+            self._in_use.add(conn)
+            self._in_use_max = max(self._in_use_max, len(self._in_use))
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        return conn
+
+    # Возврат соединения; close=True - соединение испорчено, закрыть
+    def putconn(self, conn, close=False):
+        with self._cond:
+            if conn not in self._in_use:
+                raise PoolError("Соединение не выдано этим пулом")
+            self._in_use.discard(conn)
+        if not close and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception as e:
+                logging.warning(f"Ошибка сброса соединения пула БД: {e}")
+                close = True
+        if close or conn.closed or self._closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    # with db_pool.connection() as conn: ... - соединение вернётся в пул
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        except psycopg2.InterfaceError:
+            self.putconn(conn, close=True)
+            raise
+        except BaseException:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "maxconn": self.maxconn,
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "in_use_max": self._in_use_max,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_avg_ms": (
+                    round(self._wait_total / self._checkouts * 1000, 2)
+                    if self._checkouts
+                    else 0.0
+                ),
+                "wait_max_ms": round(self._wait_max * 1000, 2),
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "broken": self._broken,
+            }
@@ -1,18 +1,16 @@
 import calendar
-import json
 import logging
 import os
-import queue
 
 # Библиотека для параллельных потоков
 import threading
 import time
+import zlib
 from collections import defaultdict
 from copy import deepcopy
 from datetime import datetime, timedelta
 from logging.handlers import RotatingFileHandler
 from random import randint
-from urllib.parse import quote
 
 # import sqlite3
 import flask
@@ -21,23 +19,103 @@ import requests
 
 # Импорт для бота
 import telebot
-from bs4 import BeautifulSoup
-
-# Для парсинга страниц
-from bs4.filter import SoupStrainer
-from psycopg2 import pool  # Пул соединений
+from psycopg2.extras import execute_values
 from telebot import apihelper, types
 
 # Список станций
 from all_stations_list import all_station_list, all_station_list_lower
+from async_engine import AsyncTrackingEngine
+from db_executor import DbExecutor
+from db_pool import DbPool
+from parse_pool import parse_pool, parse_route_body
+from polling_policy import PollingPolicy
+from queries import (
+    CHECK_USER_EXISTS,
+    COUNT_ROUTES_DEPENDENTS,
+    DELETE_ROUTES,
+    DELETE_ROUTES_TRACKING,
+    DELETE_ROUTES_TRAINS,
+    DELETE_TRACKING,
+    DELETE_TRACKING_BY_ID,
+    DELETE_USER,
+    DELETE_USER_TRACKINGS,
+    GET_ALL_ACTIVE_TRACKINGS,
+    GET_ROUTE_ID,
+    GET_ROUTE_TRACKINGS,
+    GET_ROUTE_TRAINS,
+    GET_TRACK_LIST,
+    GET_TRACKING_STATUS,
+    GET_TRAIN_ID,
+    SELECT_EXPIRED_ROUTES,
+    UPDATE_TRACKING,
+)
+from route_cache import (
+    CachedPage,
+    get_route_page,
+    route_cache,
+)
+
+# Для парсинга страниц
+from route_parser import (
+    RouteSnapshot,
+    diff_trains,
+    find_train,
+    trains_fingerprint,
+)
+from scheduler import Scheduler
+from schema import (
+    CASCADE_VERSION,
+    SCHEMA_VERSION,
+    applied_version,
+    migrate,
+)
+from seat_vector import (
+    decode_seats,
+    encode_seats,
+    format_seats,
+    has_unnumbered,
+    is_scarce,
+    seat_vector,
+)
+from site_client import (
+    TIMEOUT,
+    RateLimitWaitError,
+    SiteResponseError,
+    breaker_stats,
+    check_route_response,
+    conditional_headers,
+    limiter_stats,
+    outage_retry_after,
+    page_fingerprint,
+    route_headers,
+    route_url,
+)
 from token_info import (  # web_port, - Для разработки
+    async_engine_concurrency,
+    async_engine_share,
+    cleanup_batch_size,
+    db_call_timeout,
+    db_conn_check_idle,
+    db_conn_max_age,
     db_host,
+    db_migrate,
     db_name,
     db_password,
+    db_pool_max,
+    db_pool_min,
+    db_pool_timeout,
     db_port,
     db_user,
+    db_workers,
+    poll_budget_per_minute,
+    poll_max_interval,
+    poll_min_interval,
+    rate_limit_user_max_wait,
     stop_code,
+    stream_stop_early,
     token,
+    tracking_engine,
+    tracking_workers,
     webhook_url,
 )
 
@@ -52,23 +130,6 @@ class FutureDateError(ValueError):
     pass
 
 
-# Класс ошибки для "Ошибка сайта"
-class SiteResponseError(Exception):
-    pass
-
-
-# Словарь соответствия номер-название класса
-seats_type_dict = {
-    "0": "Без нумерации 🚶‍♂️",
-    "1": "Общий 🚃",
-    "2": "Сидячий 💺",
-    "3": "Плацкартный 🛏️",
-    "4": "Купейный 🚪🛏️",
-    "5": "Мягкий 🛋️",
-    "6": "СВ 👑",
-}
-
-
 # В начале кода создаем словарь для временного хранения вводимых данных
 user_data = defaultdict(
     lambda: {}
@@ -135,10 +196,14 @@ def del_user_data(chat_id):
 # # Создание БД и подключение
 
 
-# Postgres Создание пула подключений
-db_pool = pool.SimpleConnectionPool(
-    minconn=1,
-    maxconn=10,
+# Postgres Создание пула подключений (потокобезопасный, с проверкой
+# соединений; метрики - в collect_stats)
+db_pool = DbPool(
+    minconn=db_pool_min,
+    maxconn=db_pool_max,
+    timeout=db_pool_timeout,
+    max_age=db_conn_max_age,
+    check_idle=db_conn_check_idle,
     dbname=db_name,
     user=db_user,
     password=db_password,
@@ -196,39 +261,33 @@ try:
     logging.debug(f"Соединение c БД успешно: {result}")
 except Exception as e:
     logging.debug(f"Ошибка соединения: {e}")
-# ----------------------------------------------------------------------------
-# Общая очередь задач для БД
-db_queue = queue.Queue()
-
 
-# Поток-обработчик БД, работает в отдельном потоке
-def db_worker():
-    while True:
-        func, args, result_queue = db_queue.get()  # Получить задачу из очереди
-        try:
-            result = func(*args)  # Выполнить функцию с аргументами
-            result_queue.put(result)  # Отправить результат обратно
-        except Exception as e:
-            logging.error(f"Ошибка в db_worker: {e}")
-            result_queue.put(e)  # Отправить исключение
-        db_queue.task_done()
-
-
-# Запуск потока
-threading.Thread(target=db_worker, daemon=True).start()
+# Создание и обновление таблиц и индексов (версии схемы - в schema.py)
+if db_migrate:
+    try:
+        with db_pool.connection() as conn:
+            applied = migrate(conn)
+        logging.info(
+            f"Схема БД версии {SCHEMA_VERSION}, применены: {applied or 'нет'}"
+        )
+    except Exception as e:
+        logging.error(f"Ошибка миграции схемы БД: {e}")
+# ----------------------------------------------------------------------------
+# Выполнение обращений к БД в db_workers потоках
+# (не больше, чем соединений в пуле)
+db_executor = DbExecutor(
+    workers=min(db_workers, db_pool_max), timeout=db_call_timeout
+)
+db_executor.start()
 
 
-# Универсальная функция-обёртка добавления функций в очередь
-def async_db_call(func, *args, **kwargs):
-    # Создать очередь
-    result_queue = queue.Queue()
-    # Добавить функцию в очередь
-    db_queue.put((func, args, result_queue))
-    # Вернуть результат или исключение
-    result = result_queue.get()
-    if isinstance(result, Exception):
-        raise result
-    return result
+# Универсальная функция-обёртка выполнения функций в потоках БД
+# order_key - обращения с одинаковым ключом (chat_id) выполняются
+# по очереди в порядке вызова
+def async_db_call(func, *args, order_key=None, timeout=None, **kwargs):
+    return db_executor.call(
+        func, *args, order_key=order_key, timeout=timeout, **kwargs
+    )
 
 
 # ----------------------------------------------------------------------------
@@ -250,89 +309,84 @@ def add_user_db(chat_id):
         raise
 
 
-def add_route_db(city_from, city_to, date, url):
+# Маршрут и все его поезда - одной транзакцией: два запроса вместо
+# SELECT + INSERT + COMMIT на каждый поезд.
+# trains - записи поездов (number, time_depart, time_arriv).
+# Возвращает словарь {номер поезда: train_id}
+def add_route_trains_db(city_from, city_to, date, url, trains):
+    # Повтор ключа в одном INSERT ... ON CONFLICT DO UPDATE - ошибка
+    rows = {
+        (train.number, train.time_depart, train.time_arriv): None
+        for train in trains
+    }
     try:
-        # Благодаря URL UNIQUE не будет повторной записи
-        execute_db_query(
-            """
-            INSERT INTO routes (city_from, city_to, date, url)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (url) DO NOTHING
-            """,
-            (city_from, city_to, date, url),
-            commit=True,
+        with db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                # DO UPDATE вместо DO NOTHING, чтобы RETURNING вернул id
+                # и для уже существующих строк
+                cursor.execute(
+                    """
+                    INSERT INTO routes (city_from, city_to, date, url)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (url) DO UPDATE SET url = EXCLUDED.url
+                    RETURNING route_id
+                    """,
+                    (city_from, city_to, date, url),
+                )
+                route_id = cursor.fetchone()[0]
+                train_ids = {}
+                if rows:
+                    result = execute_values(
+                        cursor,
+                        """
+                        INSERT INTO trains
+                        (route_id, train_number, time_depart, time_arriv)
+                        VALUES %s
+                        ON CONFLICT
+                        (route_id, train_number, time_depart, time_arriv)
+                        DO UPDATE SET train_number = EXCLUDED.train_number
+                        RETURNING train_number, train_id
+                        """,
+                        [(route_id,) + row for row in rows],
+                        page_size=len(rows),
+                        fetch=True,
+                    )
+                    # Первый train_id для номера - как в find_train
+                    for number, train_id in result:
+                        train_ids.setdefault(number, train_id)
+            conn.commit()
+        logging.info(
+            f"Route {city_from}-{city_to}-{date} ({len(rows)} trains)"
+            f" added to database"
         )
-        logging.info(f"Route {city_from}-{city_to}-{date} added to database")
+        return train_ids
     except Exception as e:
-        logging.error(f"Database error in add_route_db: {str(e)}")
+        logging.error(f"Database error in add_route_trains_db: {str(e)}")
         raise
 
 
-def add_train_db(train, time_depart, time_arriv, url):
-    try:
-        result = execute_db_query(
-            "SELECT route_id FROM routes WHERE url = %s",
-            (url,),
-            fetchone=True,
+# Получить train_id по URL маршрута и номеру поезда
+def get_train_id_db(train_number, url):
+    result = execute_db_query(GET_TRAIN_ID, (url, train_number), fetchone=True)
+    if not result:
+        logging.warning(
+            f"Train not found for url={url}, number={train_number}"
         )
+        return None
+    return result[0]
 
-        if result is None:
-            # Условие для избежания случайной ошибки.
-            # В нормальном режиме невозможно
-            logging.warning(f"No route found for URL: {url}")
-            return
 
-        route_id = result[0]
-        execute_db_query(
-            """
-            INSERT INTO trains
-            (route_id, train_number, time_depart, time_arriv)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT
-            (route_id, train_number, time_depart, time_arriv) DO NOTHING
-            """,
-            (route_id, train, time_depart, time_arriv),
-            commit=True,
-        )
-
-        logging.info(
-            f"Train: {train} for route_id: {route_id} added to database"
-        )
-    except Exception as e:
-        logging.error(f"Database error in add_train_db: {str(e)}")
-        raise
-
-
-def add_tracking_db(chat_id, train_selected, ticket_dict, url):
+# train_id известен после add_route_trains_db - без повторного поиска
+def add_tracking_db(chat_id, train_selected, ticket_dict, url, train_id=None):
 
     try:
-        result = execute_db_query(
-            "SELECT route_id FROM routes WHERE url = %s", (url,), fetchone=True
-        )
-        if result is None:
-            logging.warning(f"No route found for URL: {url}")
-            return
-        route_id = result[0]
-
-        # Получить train_id по route_id и номеру поезда
-        result = execute_db_query(
-            """
-            SELECT train_id FROM trains
-            WHERE route_id = %s AND train_number = %s
-            """,
-            (route_id, train_selected),
-            fetchone=True,
-        )
-        if not result:
-            logging.warning(
-                f"Train not found for route_id={route_id}, "
-                f"number={train_selected}"
-            )
+        if train_id is None:
+            train_id = get_train_id_db(train_selected, url)
+        if train_id is None:
             return
-        train_id = result[0]
 
-        # Преобразование словаря билетов в JSON
-        json_ticket_dict = json.dumps(ticket_dict)
+        # Вектор мест в компактном виде
+        json_ticket_dict = encode_seats(ticket_dict)
 
         # Вставка в список слежения
         execute_db_query(
@@ -354,22 +408,14 @@ def add_tracking_db(chat_id, train_selected, ticket_dict, url):
 def get_trains_list_db(url):
     try:
         # Получить route_id по URL
-        result = execute_db_query(
-            "SELECT route_id FROM routes WHERE url = %s", (url,), fetchone=True
-        )
+        result = execute_db_query(GET_ROUTE_ID, (url,), fetchone=True)
         if not result:
             logging.warning(f"No route found for URL: {url}")
             return []
         route_id = result[0]
         # Получить список поездов по route_id
         trains_list = execute_db_query(
-            """
-            SELECT train_number, time_depart, time_arriv FROM trains
-            WHERE route_id = %s
-            ORDER BY time_depart
-            """,
-            (route_id,),
-            fetchall=True,
+            GET_ROUTE_TRAINS, (route_id,), fetchall=True
         )
     except Exception as e:
         logging.error(f"Database error in get_trains_list_db: {str(e)}")
@@ -377,77 +423,16 @@ def get_trains_list_db(url):
     return trains_list
 
 
-# Получить данные для цикла отслеживания поезда
-def get_loop_data_list(chat_id, train_tracking, url):
-    try:
-        query = """
-            SELECT r.route_id, t.train_id,
-            EXISTS (
-                SELECT 1 FROM tracking tr
-                WHERE tr.train_id = t.train_id AND tr.chat_id = %s
-            ) AS is_tracked
-            FROM routes r
-            JOIN trains t ON r.route_id = t.route_id
-            WHERE r.url = %s AND t.train_number = %s
-            LIMIT 1
-        """
-        resp = execute_db_query(
-            query, (chat_id, url, train_tracking), fetchone=True
-        )
-        if not resp:
-            logging.warning(
-                f"No matching train or route found for chat_id: "
-                f"{chat_id}, url: {url}, train: {train_tracking}"
-            )
-            return None
-        # Отдельный запрос: сколько активных отслеживаний у пользователя
-        count_result = execute_db_query(
-            """
-            SELECT COUNT(*) FROM tracking WHERE chat_id = %s
-            """,
-            (chat_id,),
-            fetchone=True,
-        )
-        count = count_result[0] if count_result else 0
-        result = {
-            "route_id": resp[0],
-            "train_id": resp[1],
-            "status_exist": resp[2],
-            "count": count,
-        }
-        return result
-    except Exception as e:
-        logging.error(f"Database error in get_loop_data_list: {str(e)}")
-        raise
-
-
-# Получение свежих данных из таблицы при отслеживании
-def get_fresh_loop(
-    chat_id,
-    train_id,
-):
+# Отслеживает ли пользователь поезд и сколько у него отслеживаний
+# (train_id известен из сессии - маршрут и поезд заново не ищутся)
+def get_tracking_status(chat_id, train_id):
     try:
         result = execute_db_query(
-            """
-            SELECT json_ticket_dict FROM tracking
-            WHERE chat_id = %s AND train_id = %s
-            """,
-            (chat_id, train_id),
-            fetchone=True,
+            GET_TRACKING_STATUS, (chat_id, train_id, chat_id), fetchone=True
         )
-        if result:
-            json_str = result[0]  # Распаковываем кортеж
-            memory_ticket_dict = json.loads(json_str)  # Декодируем JSON строку
-            logging.debug(
-                f"FG2 memory_ticket_dict, chat_id, train_id:\n"
-                f" {memory_ticket_dict, chat_id, train_id}"
-            )
-        else:
-            # Обработка случая, когда запись не найдена
-            memory_ticket_dict = {}
-        return memory_ticket_dict
+        return {"status_exist": result[0], "count": result[1]}
     except Exception as e:
-        logging.error(f"Database error in get_fresh_loop: {str(e)}")
+        logging.error(f"Database error in get_tracking_status: {str(e)}")
         raise
 
 
@@ -459,16 +444,7 @@ def get_track_list(message):
 
     try:
         track_list = execute_db_query(
-            """
-            SELECT tracking_id, t.train_number,
-                   r.city_from, r.city_to, r.date, t.time_depart
-            FROM tracking tr
-            JOIN trains t ON tr.train_id = t.train_id
-            JOIN routes r ON t.route_id = r.route_id
-            WHERE tr.chat_id = %s
-            """,
-            (chat_id,),
-            fetchall=True,
+            GET_TRACK_LIST, (chat_id,), fetchall=True
         )
         return track_list
 
@@ -483,14 +459,7 @@ def del_tracking_db(
     train_id,
 ):
     try:
-        execute_db_query(
-            """
-            DELETE FROM tracking
-            WHERE chat_id = %s AND train_id = %s
-            """,
-            (chat_id, train_id),
-            commit=True,
-        )
+        execute_db_query(DELETE_TRACKING, (chat_id, train_id), commit=True)
 
     except Exception as e:
         logging.error(f"Database error in del_tracking_db: {str(e)}")
@@ -505,11 +474,7 @@ def update_tracking_loop(
 ):
     try:
         execute_db_query(
-            """
-            UPDATE tracking
-            SET json_ticket_dict = %s
-            WHERE chat_id = %s AND train_id = %s
-            """,
+            UPDATE_TRACKING,
             (json_ticket_dict, chat_id, train_id),
             commit=True,
         )
@@ -522,13 +487,7 @@ def update_tracking_loop(
 # Проверка пользователя в БД
 def check_user_exists(chat_id):
     try:
-        result = execute_db_query(
-            """
-            SELECT EXISTS(SELECT 1 FROM users WHERE chat_id = %s)
-            """,
-            (chat_id,),
-            fetchone=True,
-        )
+        result = execute_db_query(CHECK_USER_EXISTS, (chat_id,), fetchone=True)
         return bool(result[0]) if result else False
     except Exception as e:
         logging.error(f"Database error in check_user_exists: {str(e)}")
@@ -637,6 +596,13 @@ def index():
     return "Bot is alive", 200
 
 
+# Метрики нагрузки на сайт и движков отслеживания (для подбора
+# параметров развёртывания). Путь с токеном - защита от чужих запросов
+@app.route(f"/{token}/stats", methods=["GET"])
+def stats():
+    return flask.jsonify(collect_stats()), 200
+
+
 # ==============================================
 
 
@@ -666,7 +632,7 @@ def start(message):
         set_user_data(chat_id, {"step": "start"})
 
         # Добавить пользователя в БД
-        async_db_call(add_user_db, chat_id)
+        async_db_call(add_user_db, chat_id, order_key=chat_id)
     except Exception as e:
         logging.error(f"Error in start command: {str(e)}", exc_info=True)
         raise
@@ -779,18 +745,18 @@ def get_trains_list(message):
         raise ValueError("User data not found")
 
     try:
-        q_from = quote(user_info["city_from"])
-        q_to = quote(user_info["city_to"])
+        city_from = user_info["city_from"]
+        city_to = user_info["city_to"]
         date = user_info["date"]
     except KeyError as e:
         logging.error(f"Missing key in user data: {e}")
         raise ValueError(f"Incomplete user data: missing {e}")
 
-    # Получение новой страницы "soup"
-    url = f"https://pass.rw.by/ru/route/?from={q_from}&to={q_to}&date={date}"
+    # Получение новой страницы маршрута
+    url = route_url(city_from, city_to, date)
     update_user_data(chat_id, "url", url)
     try:
-        r = requests.get(url)
+        r = get_user_route_page(url)
         logging.info(f"FLAG get_trains_list   {r.status_code}")
         if r.status_code != 200:
             error_msg = (
@@ -801,15 +767,26 @@ def get_trains_list(message):
                 f"Ошибка ответа сайта. Код {r.status_code}"
             )
 
-        only_span_div_tag = SoupStrainer(["span", "div"])
-        soup = BeautifulSoup(r.text, "lxml", parse_only=only_span_div_tag)
+        # Все поезда страницы за один проход
+        snapshot = RouteSnapshot(
+            url, r.parsed_trains(), fetched_at=r.fetched_at
+        )
 
-        response_time = r.elapsed.total_seconds()  # время в секундах
+        response_time = r.elapsed  # время в секундах
         logging.info(
             f"Запрос на сайт \n{user_data[chat_id]}"
             f"выполнен за {response_time:.3f} секунд"
         )
 
+    except RateLimitWaitError as e:
+        logging.warning(f"get_trains_list для {chat_id}: {e}")
+        bot.send_message(
+            chat_id,
+            "⏳ Сайт перегружен запросами.\n"
+            "Повторите ввод маршрута через минуту",
+        )
+        start(message)
+        return
     except Exception as e:
         logging.error(f"Server request error: {e}")
         bot.send_message(
@@ -818,23 +795,22 @@ def get_trains_list(message):
         # Возвращаемся к началу
         start(message)
         return
-    # Добавляет маршрут в БД
-    async_db_call(
-        add_route_db,
+    # Маршрут и его поезда - в БД одной транзакцией
+    train_ids = async_db_call(
+        add_route_trains_db,
         user_info["city_from"],
         user_info["city_to"],
         date,
         url,
+        list(snapshot),
     )
 
-    # Обновление страницы
-    update_user_data(chat_id, "soup", soup)
-
-    train_id_list = [
-        i.text for i in soup.find_all("span", class_="train-number")
-    ]
+    # В сессии - компактный снимок поездов маршрута, а не дерево страницы,
+    # и id поездов в БД для следующих шагов
+    update_user_data(chat_id, "route", snapshot)
+    update_user_data(chat_id, "train_ids", train_ids)
 
-    if not train_id_list:
+    if not snapshot:
         bot.send_message(
             chat_id,
             "❓🚆Поезда не найдены.\
@@ -843,27 +819,7 @@ def get_trains_list(message):
         start(message)
         return
 
-    trains_list = []
-    # Получение времени отправления и прибытия
-    for train in train_id_list:
-        try:
-            time_depart = soup.select(
-                f'[data-train-number^="{train}"] \
-                                    [data-sort="departure"]'
-            )[0].text.strip()
-            time_arriv = soup.select(
-                f'[data-train-number^="{train}"] \
-                                    [data-sort="arrival"]'
-            )[0].text.strip()
-        except Exception:
-            time_depart, time_arriv = (
-                "Нет данных",
-                "Нет данных",
-            )
-        trains_list.append([train, time_depart, time_arriv])
-        # Добавить поезда в БД
-        async_db_call(add_train_db, train, time_depart, time_arriv, url)
-        # Отобразить список поездов
+    # Отобразить список поездов
     show_train_list(message)
 
 
@@ -900,6 +856,49 @@ def show_train_list(message):
     )
 
 
+# Страница маршрута для обработчиков пользователя: очередь запросов к сайту
+# ждать не дольше RATE_LIMIT_USER_MAX_WAIT (её занимают и задачи
+# отслеживания), иначе - устаревшая страница из кэша, если она есть
+def get_user_route_page(url):
+    try:
+        return get_route_page(url, max_wait=rate_limit_user_max_wait)
+    except RateLimitWaitError as e:
+        page = route_cache.peek(url, max_age=float("inf"))
+        if page is None:
+            raise
+        logging.info(
+            f"{e}: страница {url} из кэша ({page.age():.0f} сек назад)"
+        )
+        return page
+
+
+# Снимок маршрута из сессии. Если снимка нет или он старше
+# ROUTE_CACHE_TTL - страница берётся заново (через общий кэш) и снимок
+# в сессии обновляется
+def get_route_snapshot(chat_id):
+    session = get_user_data(chat_id)
+    url = session["url"]
+    snapshot = session.get("route")
+    if (
+        snapshot is not None
+        and snapshot.url == url
+        and snapshot.age() <= route_cache.ttl
+    ):
+        return snapshot
+
+    try:
+        r = get_user_route_page(url)
+    except RateLimitWaitError:
+        # Очередь запросов к сайту длинная - устаревший снимок сессии
+        if snapshot is not None and snapshot.url == url:
+            return snapshot
+        raise
+    check_route_response(r.url, r.status_code, r.content)
+    snapshot = RouteSnapshot(url, r.parsed_trains(), fetched_at=r.fetched_at)
+    update_user_data(chat_id, "route", snapshot)
+    return snapshot
+
+
 # Выбор конкретного поезда из списка, отображение наличия мест
 @bot.callback_query_handler(
     func=lambda callback: callback.data.endswith("_selected")
@@ -911,10 +910,18 @@ def select_train(callback):
 
     train_selected = callback.data.split("_")[0]
     chat_id = callback.message.chat.id
-    # Получаем из сессии здесь, т.к. дальше не передаётся объект message
-    soup = user_data[chat_id]["soup"]
+    # Поезда маршрута из снимка в сессии (запрос на сайт - только
+    # если снимок устарел)
+    try:
+        trains = get_route_snapshot(chat_id)
+    except Exception as e:
+        logging.error(f"Server request error in select_train: {e}")
+        bot.send_message(
+            chat_id, "⚠️ Ошибка запроса на сервер.\nПовторите ввод маршрута"
+        )
+        return
     # Вывод количества мест по классам или "Мест нет"
-    ticket_dict = check_tickets_by_class(train_selected, soup, chat_id)
+    ticket_dict = check_tickets_by_class(train_selected, trains, chat_id)
 
     # Добавляем в список поездов, но здесь статус отслеживания пока что False
     # Здесь, т.к. необходимо получить список мест для контроля изменений
@@ -924,7 +931,7 @@ def select_train(callback):
     markup = types.InlineKeyboardMarkup()
 
     # Если 'Без нумерованных мест' возврат на выбор поезда
-    if seats_type_dict["0"] in ticket_dict:
+    if has_unnumbered(ticket_dict):
         btn_track = types.InlineKeyboardButton(
             "🔄 Назад к поездам",
             callback_data="re_get_trains_list",
@@ -937,7 +944,7 @@ def select_train(callback):
             reply_markup=markup,
         )
     # Проверка времени отправления
-    elif check_depart_time(train_selected, soup, train_id=None) <= 0:
+    elif check_depart_time(train_selected, trains) <= 0:
         btn_track = types.InlineKeyboardButton(
             "🔄 Назад к поездам",
             callback_data="re_get_trains_list",
@@ -958,7 +965,7 @@ def select_train(callback):
 
         bot.send_message(
             chat_id=callback.message.chat.id,
-            text=f"🚆 Поезд №{train_selected}\n{ticket_dict}",
+            text=f"🚆 Поезд №{train_selected}\n{format_seats(ticket_dict)}",
             reply_markup=markup,
         )
 
@@ -986,183 +993,506 @@ def add_track_train(message):
         pass
 
 
-# Включение отслеживания, добавление поезда в лист слежения
-# Включение отслеживания, добавление поезда в лист слежения
+# =============================================================================
+# Отслеживание поездов
+# Отслеживания выполняет планировщик (scheduler.Scheduler) с фиксированным
+# пулом потоков. На каждый маршрут (routes.url) с активными отслеживаниями
+# заводится одна задача: страница маршрута скачивается и разбирается один раз
+# за запуск, а результат раздаётся всем отслеживаниям поездов маршрута
+# (tracking -> trains.route_id -> routes.url).
+
+# Максимум ошибок подряд для одного отслеживания
+MAX_TRACKING_ERRORS = 10
+# Интервал сверки задач планировщика со списком отслеживаний в БД, сек
+ROUTE_SYNC_INTERVAL = 300
+
+tracking_scheduler = Scheduler(workers=tracking_workers, name="tracking")
+# Интервалы опроса маршрутов в пределах общего бюджета запросов к сайту
+polling_policy = PollingPolicy(
+    min_interval=poll_min_interval,
+    max_interval=poll_max_interval,
+    budget=poll_budget_per_minute,
+)
 
 
-def tracking_loop(chat_id, train_tracking, train_id, route_id, url):
-    logging.debug(f"Tracking train {train_tracking} for user {chat_id}")
+# Состояние задачи опроса маршрута между запусками
+class RouteJobState:
+    __slots__ = (
+        "url",
+        "error_streaks",
+        "route_error_streak",
+        "fingerprint",
+        "fingerprint_keys",
+        "departs_at",
+        "etag",
+        "last_modified",
+        "volatility",
+        "scarce",
+        "interval",
+        "trains",
+        "synced_keys",
+    )
 
-    # Счётчик ошибок
-    error_streak = 0
-    max_errors = 10
-    # # Максимально:  10 ошибок
-    # # Ночное время
-    # start_night = datetime(year=1, month=1, day=1, hour=1).time()
-    # end_night = datetime(year=1, month=1, day=1, hour=7).time()
-    while True:
+    def __init__(self, url):
+        self.url = url
+        # Счётчики ошибок подряд, ключ - (chat_id, train_id)
+        self.error_streaks = {}
+        # Ошибки подряд при получении страницы маршрута
+        self.route_error_streak = 0
+        # Отпечаток последней полностью обработанной страницы и
+        # отслеживания (chat_id, train_id), которые её уже видели
+        self.fingerprint = None
+        self.fingerprint_keys = frozenset()
+        # Время отправления (time.time()) отслеживаемых поездов
+        self.departs_at = {}
+        # Валидаторы HTTP-кэша из последнего ответа сайта
+        self.etag = None
+        self.last_modified = None
+        # Доля опросов с изменением мест (скользящее среднее), признак
+        # "мест нет или почти нет" и последний интервал опроса, сек
+        self.volatility = 0.0
+        self.scarce = False
+        self.interval = 800
+        # Поезда прошлого разбора маршрута и отслеживания, у которых
+        # сохранённые места совпадают с ним
+        self.trains = None
+        self.synced_keys = frozenset()
+
+
+# Группировка активных отслеживаний по URL маршрута
+def group_trackings_by_route(rows):
+    routes = defaultdict(list)
+    for row in rows:
+        # row: chat_id, train_number, train_id, route_id, url
+        routes[row[4]].append(row)
+    return routes
+
+
+# Заголовки запроса страницы маршрута с валидаторами прошлого ответа
+def route_request_headers(state):
+    headers = route_headers(state.url)
+    # Условный запрос имеет смысл, только если есть разобранная страница
+    if state.fingerprint is not None:
+        headers.update(conditional_headers(state.etag, state.last_modified))
+    return headers
+
+
+# Секунды до отправления поезда по странице маршрута (None - нет данных)
+def departure_seconds(trains, train_number):
+    train = find_train(trains, train_number)
+    return train.seconds_to_depart if train is not None else None
+
+
+# Обработка одного отслеживания по уже разобранной странице маршрута.
+# notify(chat_id, text, reply_markup=None) - отправка сообщения пользователю.
+# check_seats=False - места поезда не менялись с прошлого разбора маршрута,
+# сравнивать с сохранёнными не нужно.
+# Возвращает (ticket_dict, были ли изменения); ticket_dict = None,
+# если отслеживание завершено
+def process_tracking(row, trains, notify, check_seats=True):
+    chat_id, train_tracking, train_id, _, url, json_ticket_dict, date = row
+
+    # Проверка времени
+    # (прекратить отслеживание за 15 мин до отправления)
+    if check_depart_time(train_tracking, trains, date) < 1000:
+        # Удалить маршрут из списка отслеживания
+        async_db_call(del_tracking_db, chat_id, train_id, order_key=chat_id)
+        notify(
+            chat_id,
+            f"Отслеживание завершёно по расписанию"
+            f" отправления поезда {train_tracking}",
+        )
+        logging.info(
+            f"Отслеживание завершено за 15 мин до отпр.: "
+            f"{train_tracking} для {chat_id}"
+        )
+        return None, False
+
+    # Получение более свежей информации по билетам
+    ticket_dict = check_tickets_by_class(train_tracking, trains, chat_id)
+    if not check_seats:
+        return ticket_dict, False
+
+    # Сохранённые данные о билетах - из строки отслеживания
+    memory_ticket_dict = decode_seats(json_ticket_dict)
+
+    # Выводить сообщение при появлении изменений в билетах
+    #  + быстрая ссылка
+    logging.debug(f"FLAG3  ticket_dict  {ticket_dict}")
+    if ticket_dict != memory_ticket_dict:
+        markup_url = types.InlineKeyboardMarkup()  # объект кнопки
+        url_to_ticket = types.InlineKeyboardButton("На сайт", url=url)
+        markup_url.row(url_to_ticket)
+        notify(
+            chat_id,
+            f"Обновление по {train_tracking}:\n"
+            f"{format_seats(ticket_dict)}",
+            reply_markup=markup_url,
+        )
+
+        json_ticket_dict = encode_seats(ticket_dict)
+
+        # Обновление таблицы отслеживания в цикле
+        async_db_call(
+            update_tracking_loop,
+            json_ticket_dict,
+            chat_id,
+            train_id,
+            order_key=chat_id,
+        )
+        return ticket_dict, True
+    return ticket_dict, False
+
+
+# Учёт ошибки отслеживания. После max ошибок подряд отслеживание удаляется
+def register_tracking_error(state, row, error, notify):
+    chat_id, train_tracking, train_id = row[:3]
+    key = (chat_id, train_id)
+    streak = state.error_streaks.get(key, 0)
+    logging.warning(
+        f"Tracking failed for train {train_tracking}, "
+        f"error_streak = {streak} user {chat_id}: {str(error)}"
+    )
+    if streak >= MAX_TRACKING_ERRORS:
+        state.error_streaks.pop(key, None)
+        # Удалить маршрут из списка отслеживания
+        async_db_call(del_tracking_db, chat_id, train_id, order_key=chat_id)
+        error_msg = (
+            f"❗ Ошибка бота\n"
+            f"Отслеживание поезда {train_tracking} остановлено"
+        )
+        notify(chat_id, error_msg)
+        return
+    state.error_streaks[key] = streak + 1
+
+
+# Активные отслеживания маршрута; заодно забыть ошибки удалённых
+def load_route_rows(state):
+    rows = async_db_call(get_route_trackings, state.url)
+    if not rows:
+        polling_policy.forget(state.url)
+    active_keys = {(row[0], row[2]) for row in rows or []}
+    for key in list(state.error_streaks):
+        if key not in active_keys:
+            state.error_streaks.pop(key, None)
+    return rows
+
+
+# Сбой получения страницы маршрута: ошибка засчитывается всем отслеживаниям.
+# Возвращает задержку до следующего опроса (растёт с числом ошибок)
+def handle_route_failure(state, rows, error, notify):
+    # Сайт недоступен целиком (предохранитель открыт): это не ошибка
+    # отслеживаний - опрос маршрута просто откладывается
+    retry_after = outage_retry_after(state.url)
+    if retry_after is not None:
+        logging.info(
+            f"Сайт недоступен, опрос {state.url} отложен "
+            f"на {retry_after:.0f} сек: {error}"
+        )
+        return retry_after + randint(0, 60)
+
+    logging.warning(f"Route poll failed for {state.url}: {error}")
+    for row in rows:
+        register_tracking_error(state, row, error, notify)
+    state.route_error_streak += 1
+    return state.route_error_streak * 600
+
+
+# Раздача разобранной страницы всем отслеживаниям маршрута.
+# Сначала маршрут целиком сравнивается с прошлым разбором: места
+# сверяются с сохранёнными и обновляются в БД только у отслеживаний
+# поездов, которые изменились (и у новых отслеживаний).
+# Возвращает (все ли отслеживания обработаны без ошибок, были ли изменения)
+def handle_route_page(state, rows, trains, notify):
+    state.route_error_streak = 0
+    changed_trains = diff_trains(state.trains, trains)
+    synced_keys = set()
+    success = True
+    changed = False
+    scarce = False
+    for row in rows:
+        key = (row[0], row[2])
+        train = find_train(trains, row[1])
+        check_seats = (
+            key not in state.synced_keys
+            or train is None
+            or train.number in changed_trains
+        )
         try:
-            # Время обращения к БД от пользователя для debug
-            start_time_db_loop = time.time()
+            ticket_dict, row_changed = process_tracking(
+                row, trains, notify, check_seats
+            )
+            state.error_streaks.pop(key, None)
+            changed = changed or row_changed
+            if ticket_dict is not None:
+                synced_keys.add(key)
+                if is_scarce(ticket_dict):
+                    scarce = True
+        except Exception as e:
+            success = False
+            register_tracking_error(state, row, e, notify)
+    state.trains = trains
+    state.synced_keys = frozenset(synced_keys)
+    state.scarce = scarce
+    return success, changed
+
+
+# Задержка до следующего опроса маршрута по политике опроса: время до
+# ближайшего отправления, частота изменений мест, наличие мест
+def next_poll_delay(state, changed):
+    state.volatility = 0.8 * state.volatility + 0.2 * changed
+    seconds_to_depart = None
+    if state.departs_at:
+        seconds_to_depart = min(state.departs_at.values()) - time.time()
+    interval = polling_policy.interval(
+        state.url, seconds_to_depart, state.volatility, state.scarce
+    )
+    # Не пропустить отметку окончания отслеживания (15 мин до отправления)
+    if seconds_to_depart is not None and seconds_to_depart > 1000:
+        interval = min(
+            interval,
+            max(seconds_to_depart - 1000, polling_policy.min_interval),
+        )
+    state.interval = interval
+    return interval
+
+
+# Можно ли считать страницу с тем же отпечатком "без изменений":
+# все отслеживания уже видели эту страницу и ни один поезд не подходит
+# к отметке окончания отслеживания до следующего опроса
+def can_skip_unchanged(state, rows):
+    now = time.time()
+    for row in rows:
+        if (row[0], row[2]) not in state.fingerprint_keys:
+            return False
+        depart = state.departs_at.get(row[1])
+        if depart is None or depart - now < 1000 + state.interval:
+            return False
+    return True
+
+
+# Страница не изменилась: отслеживаниям нечего сообщать
+def handle_route_unchanged(state, rows):
+    logging.debug(f"Маршрут {state.url} без изменений, разбор пропущен")
+    state.route_error_streak = 0
+    for row in rows:
+        state.error_streaks.pop((row[0], row[2]), None)
+    return next_poll_delay(state, False)
+
+
+# Обработка ответа сайта по маршруту (общая для всех движков отслеживания).
+# body - байты ответа; trains - поезда, если страница уже разобрана
+# при загрузке; partial - тело прочитано только до нужных поездов.
+# Возвращает задержку до следующего опроса
+def handle_route_response(
+    state,
+    rows,
+    status_code,
+    body,
+    headers,
+    notify,
+    trains=None,
+    partial=False,
+):
+    if status_code == 304:
+        # Сайт подтвердил, что страница не менялась (ETag/Last-Modified)
+        if state.fingerprint is not None and can_skip_unchanged(state, rows):
+            return handle_route_unchanged(state, rows)
+        # Страница нужна для разбора: повторить запрос без валидаторов
+        state.fingerprint = None
+        return randint(0, 60)
 
-            try:
-                # Запоминание данных о билете
-                memory_ticket_dict = async_db_call(
-                    get_fresh_loop, chat_id, train_id
-                )
+    try:
+        check_route_response(state.url, status_code, body)
+    except Exception as e:
+        return handle_route_failure(state, rows, e, notify)
 
-                if not memory_ticket_dict:
-                    logging.info(
-                        f"Stopping tracking for train"
-                        f"{train_tracking}, user {chat_id}"
-                    )
-                    return
-
-                session = requests.Session()
-                session.headers.update(
-                    {
-                        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"
-                        + " AppleWebKit/537.36 (KHTML, like Gecko)"
-                        + " Chrome/133.0.0.0 Safari/537.36",
-                        "Accept": "*/*",
-                        "Accept-Language": "en-GB,en-US;q=0.9,en;q=0.8,"
-                        + "ru;q=0.7,it;q=0.6",
-                        "Accept-Encoding": "gzip, deflate, br, zstd",
-                        "Referer": f"{url}",
-                        "X-Requested-With": "XMLHttpRequest",
-                    }
-                )
-                r = session.get(url)
-                if r.status_code != 200:
-                    logging.warning(
-                        f"Fail response. "
-                        f"Code {r.status_code}, train {train_tracking} "
-                        f"for user {chat_id}"
-                    )
-                    raise SiteResponseError(
-                        f"Ошибка ответа сайта. Код {r.status_code}"
-                    )
+    state.etag = headers.get("ETag")
+    state.last_modified = headers.get("Last-Modified")
+    if partial:
+        # Обрыв тела каждый раз в другом месте - отпечаток по данным поездов
+        fingerprint = trains_fingerprint(trains)
+    else:
+        fingerprint = page_fingerprint(body)
+    if fingerprint == state.fingerprint and can_skip_unchanged(state, rows):
+        return handle_route_unchanged(state, rows)
+
+    if trains is None:
+        trains = parse_route_body(body)
+    success, changed = handle_route_page(state, rows, trains, notify)
+    if success:
+        state.fingerprint = fingerprint
+        state.fingerprint_keys = frozenset((row[0], row[2]) for row in rows)
+        now = time.time()
+        state.departs_at = {}
+        for row in rows:
+            seconds = departure_seconds(trains, row[1])
+            if seconds is not None:
+                state.departs_at[row[1]] = now + seconds
+    else:
+        # При ошибках страницу надо разобрать и в следующий раз
+        state.fingerprint = None
+    return next_poll_delay(state, changed)
 
-                only_span_div_tag = SoupStrainer(["span", "div"])
-                soup = BeautifulSoup(
-                    r.text, "lxml", parse_only=only_span_div_tag
-                )
 
-                # Проверка времени
-                # (прекратить отслеживание за 15 мин до отправления)
-                if check_depart_time(train_tracking, soup, train_id) < 1000:
+# Страница маршрута для опроса отслеживаний: свежая из общего кэша или
+# с сайта, одновременные запросы одного маршрута - одним обращением
+# к сайту. При STREAM_STOP_EARLY страница разбирается только до строк
+# отслеживаемых поездов (если их нет - целиком и попадает в кэш)
+def load_tracking_page(state, rows):
+    headers = route_request_headers(state)
+    targets = {row[1] for row in rows} if stream_stop_early else None
+    return get_route_page(state.url, headers=headers, targets=targets)
 
-                    # Удалить маршрут из списка отслеживания
-                    async_db_call(
-                        del_tracking_db,
-                        chat_id,
-                        train_id,
-                    )
-                    bot.send_message(
-                        chat_id,
-                        f"Отслеживание завершёно по расписанию"
-                        f" отправления поезда {train_tracking}",
-                    )
-                    logging.info(
-                        f"[thread exit] Поток завершён за 15 мин/"
-                        f"до отпр.: {train_tracking} для {chat_id}"
-                    )
-                    return
 
-                    # Получение более свежей информации по билетам
-                ticket_dict = check_tickets_by_class(
-                    train_tracking, soup, chat_id
-                )
+# Задача планировщика: опрос одного маршрута для всех его отслеживаний.
+# Возвращает задержку до следующего опроса или None, если отслеживаний нет
+def run_route_job(job):
+    state = job.state
+    start_time_route = time.time()
 
-                # Выводить сообщение при появлении изменений в билетах
-                #  + быстрая ссылка
-                logging.debug(f"FLAG3  ticket_dict  {ticket_dict}")
-                if ticket_dict != memory_ticket_dict:
-                    markup_url = types.InlineKeyboardMarkup()  # объект кнопки
-                    url_to_ticket = types.InlineKeyboardButton(
-                        "На сайт", url=url
-                    )
-                    markup_url.row(url_to_ticket)
-                    bot.send_message(
-                        chat_id,
-                        f"Обновление по {train_tracking}:\n" f"{ticket_dict}",
-                        reply_markup=markup_url,
-                    )
+    rows = load_route_rows(state)
+    if not rows:
+        logging.info(f"Нет отслеживаний для маршрута {state.url}")
+        return None
 
-                    json_ticket_dict = json.dumps(ticket_dict)
+    try:
+        page = load_tracking_page(state, rows)
+    except Exception as e:
+        return handle_route_failure(state, rows, e, bot.send_message)
+    delay = handle_route_response(
+        state,
+        rows,
+        page.status_code,
+        page.content,
+        page.headers,
+        bot.send_message,
+        trains=page.trains,
+        partial=page.partial,
+    )
 
-                    # Обновление таблицы отслеживания в цикле
-                    async_db_call(
-                        update_tracking_loop,
-                        json_ticket_dict,
-                        chat_id,
-                        train_id,
-                    )
-                end_time_db_loop = time.time()
-                db_loop_time = end_time_db_loop - start_time_db_loop
-                logging.debug(
-                    f"Время к БД для {chat_id} в цикле loop \n\
-                        {db_loop_time:.4f} сек"
-                )
+    logging.debug(
+        f"Маршрут {state.url} обработан для {len(rows)} отслеживаний "
+        f"за {time.time() - start_time_route:.4f} сек"
+    )
+    return delay
 
-            except psycopg2.Error as e:
-                error_msg = f"Database error in tracking loop: {str(e)}"
-                logging.warning(f"{error_msg}, chat_id: {chat_id}")
-                raise
-                # При отсутствии нужной записи в БД
-            except TypeError as e:
-                error_msg = f"Database error in tracking loop: {str(e)}"
-                logging.warning(f"{error_msg}, chat_id: {chat_id}")
-                raise
-            except SiteResponseError as e:
-                error_msg = f"Site error in tracking loop: {str(e)}"
-                r_c = r.status_code
-                logging.warning(f"{error_msg},resp:{r_c}, chat_id: {chat_id}")
-                # Запомнить html при ошибке бота
-                logging.warning(f"Ответ при ошибке {r.text}")
-                raise
-            except requests.exceptions.SSLError as e:
-                error_msg = f"SSL ошибка для поезда {train_tracking}: {str(e)}"
-                logging.warning(f"{error_msg}, chat_id: {chat_id}")
-                raise
-            except requests.exceptions.RequestException as e:
-                error_msg = f"Database error in tracking loop: {str(e)}"
-                logging.warning(f"{error_msg}, chat_id: {chat_id}")
-                raise
 
-        except Exception as e:
-            logging.warning(
-                f"Tracking loop crashed for train {train_tracking}, \
-                    error_streak = {error_streak} user {chat_id}: {str(e)}",
-                exc_info=True,
-            )
-            # # Если исключение ночью - больше задержка
-            # current_time = datetime.now().time()
-            # if start_night < current_time < end_night:
-            #     max_errors = 20
-            # else:
-            #     max_errors = 5
-
-            if error_streak >= max_errors:
-                # Удалить маршрут из списка отслеживания
-                async_db_call(
-                    del_tracking_db,
-                    chat_id,
-                    train_id,
-                )
-                error_msg = (
-                    f"❗ Ошибка бота\n"
-                    f"Отслеживание поезда {train_tracking} остановлено"
-                )
-                bot.send_message(chat_id, error_msg)
-                return
+TRACKING_ENGINES = ("threads", "async", "mixed")
+if tracking_engine not in TRACKING_ENGINES:
+    raise ValueError(
+        f"Неизвестный TRACKING_ENGINE={tracking_engine}, "
+        f"допустимые значения: {', '.join(TRACKING_ENGINES)}"
+    )
 
-            error_streak += 1
-            time.sleep(error_streak * 600)
-            continue
+# Async-движок не запустился или остановился:
+# все маршруты обслуживает планировщик потоков
+async_engine_failed = threading.Event()
+async_engine_failed_lock = threading.Lock()
+
+
+# Какой движок обслуживает маршрут: "threads" или "async".
+# В режиме mixed маршруты делятся по хешу URL в доле async_engine_share %
+def route_engine(url):
+    if tracking_engine == "threads" or async_engine_failed.is_set():
+        return "threads"
+    if tracking_engine == "async":
+        return "async"
+    if zlib.crc32(url.encode()) % 100 < async_engine_share:
+        return "async"
+    return "threads"
+
+
+# Маршруты с активными отслеживаниями, которые обслуживает движок engine
+def list_engine_routes(engine):
+    rows = async_db_call(get_all_active_trackings) or []
+    return [
+        url
+        for url in group_trackings_by_route(rows)
+        if route_engine(url) == engine
+    ]
+
+
+# Функции main.py, которые использует async-движок
+class AsyncEngineHooks:
+    make_state = staticmethod(RouteJobState)
+    cached = staticmethod(route_cache.peek)
+    load_rows = staticmethod(load_route_rows)
+    headers = staticmethod(route_request_headers)
+    on_response = staticmethod(handle_route_response)
+    on_failure = staticmethod(handle_route_failure)
 
-        error_streak = 0
-        time.sleep(randint(600, 800))
+    @staticmethod
+    def list_routes():
+        return list_engine_routes("async")
+
+    @staticmethod
+    def store(url, status_code, body, headers):
+        route_cache.put(CachedPage(url, status_code, body, headers))
+
+
+# Маршруты async-движка переходят к планировщику потоков
+# (сверка sync_route_jobs сразу заводит для них задачи)
+def fallback_to_threads():
+    with async_engine_failed_lock:
+        if async_engine_failed.is_set():
+            return
+        async_engine_failed.set()
+    logging.error(
+        "Async engine недоступен, маршруты переданы планировщику потоков"
+    )
+    tracking_scheduler.start()
+    tracking_scheduler.schedule("sync_route_jobs", sync_route_jobs)
+    tracking_scheduler.reschedule("sync_route_jobs", 0)
+
+
+async_tracking_engine = AsyncTrackingEngine(
+    token,
+    AsyncEngineHooks,
+    concurrency=async_engine_concurrency,
+    executor_workers=tracking_workers,
+    sync_interval=ROUTE_SYNC_INTERVAL,
+    request_timeout=sum(TIMEOUT),
+    on_stop=fallback_to_threads,
+)
+
+
+# Завести задачу опроса маршрута в нужном движке, если её ещё нет
+def ensure_route_job(url, delay=None):
+    if delay is None:
+        delay = randint(600, 800)
+    if route_engine(url) == "async":
+        async_tracking_engine.add_route(url, delay)
+        return
+    tracking_scheduler.schedule(
+        url, run_route_job, delay=delay, state=RouteJobState(url)
+    )
+
+
+# Периодическая сверка задач планировщика с таблицей tracking
+# (восстановление после перезапуска и отслеживания, добавленные извне)
+def sync_route_jobs(job):
+    try:
+        urls = list_engine_routes("threads")
+        for url in urls:
+            # Разнести первые запросы, чтобы не опрашивать всё разом
+            ensure_route_job(url, delay=randint(0, 60))
+        logging.info(
+            f"Сверка отслеживаний: {len(urls)} маршрутов, "
+            f"{tracking_scheduler.stats()}"
+        )
+    except Exception as e:
+        logging.error(f"Ошибка сверки отслеживаний: {e}", exc_info=True)
+    return ROUTE_SYNC_INTERVAL
+
+
+# Запуск движков отслеживания согласно TRACKING_ENGINE
+def start_tracking_scheduler():
+    if tracking_engine != "async":
+        tracking_scheduler.start()
+        tracking_scheduler.schedule("sync_route_jobs", sync_route_jobs)
+    if tracking_engine != "threads" and not async_tracking_engine.start():
+        fallback_to_threads()
 
 
 @bot.callback_query_handler(
@@ -1181,32 +1511,25 @@ def start_tracking_train(callback):
     time.sleep(1)  # Optional delay
 
     url = user_data[chat_id]['url']
+    # train_id записаны при поиске маршрута (в старых сессиях их нет)
+    train_ids = user_data[chat_id].get("train_ids", {})
 
     # Изменение статуса в БД
     try:
-        # Повторное получение инф-ции по билетам для внесения в таблицу отслеж.
-        r = requests.get(url)
-        if r.status_code != 200:
-            error_msg = (
-                f"Fail response in start_tracking_train. Code {r.status_code}"
-            )
-            logging.error(f"{error_msg}, for user {chat_id}")
-            raise SiteResponseError(
-                f"Ошибка ответа сайта. Код {r.status_code}"
-            )
+        # Инф-ция по билетам для внесения в таблицу отслеж.
+        # (из снимка маршрута, устаревший снимок обновляется)
+        trains = get_route_snapshot(chat_id)
+        ticket_dict = check_tickets_by_class(train_tracking, trains, chat_id)
 
-        only_span_div_tag = SoupStrainer(["span", "div"])
-        soup = BeautifulSoup(r.text, "lxml", parse_only=only_span_div_tag)
-        ticket_dict = check_tickets_by_class(train_tracking, soup, chat_id)
+        train_id = train_ids.get(train_tracking)
+        if train_id is None:
+            train_id = async_db_call(get_train_id_db, train_tracking, url)
+        if train_id is None:
+            raise LookupError(f"Поезд {train_tracking} не найден в БД")
 
-        loop_data_list = async_db_call(
-            get_loop_data_list, chat_id, train_tracking, url
-        )
-
-        route_id = loop_data_list["route_id"]
-        train_id = loop_data_list["train_id"]
-        status_exist = loop_data_list["status_exist"]
-        count = loop_data_list["count"]
+        tracking_status = async_db_call(get_tracking_status, chat_id, train_id)
+        status_exist = tracking_status["status_exist"]
+        count = tracking_status["count"]
 
         # Проверка отслеживания поезда, чтобы не запустить излишний поток
         if status_exist:
@@ -1228,6 +1551,8 @@ def start_tracking_train(callback):
             train_tracking,
             ticket_dict,
             url,
+            train_id,
+            order_key=chat_id,
         )
 
     except psycopg2.Error as e:
@@ -1243,21 +1568,9 @@ def start_tracking_train(callback):
         start(callback.message)
         return
 
-    # Запуск отслеживания в параллельном потоке
-    # Лучше передавать аргументы, а не использовать внешние
-    # Регистрация и запуск параллельного потока с заданным именем
-    # и аргументами, чтобы не быть в ситуации, когда
-    # функция запустится через секунду-другую,
-    # а к этому времени переменные уже будут другими.
-    # Например, другой пользователь вызовет бота, и chat_id перезапишется,
-    # а старый поток будет отслеживать не того юзера.
-    thread = threading.Thread(
-        target=tracking_loop,
-        args=(chat_id, train_tracking, train_id, route_id, url),
-        name=f"tracking_{train_tracking}_{chat_id}",
-    )
-
-    thread.start()
+    # Отдельный поток не нужен: задача опроса маршрута общая для всех
+    # его поездов. Если её ещё нет - завести в планировщике
+    ensure_route_job(url)
     bot.send_message(
         chat_id, f"Отслеживание поезда {train_tracking} запущено."
     )
@@ -1350,6 +1663,7 @@ def stop_tracking_train_by_number(callback):
         async_db_call(
             _stop_tracking_logic,
             tracking_id,
+            order_key=chat_id,
         )
     except Exception:
         raise
@@ -1368,13 +1682,7 @@ def _stop_tracking_logic(
     tracking_id,
 ):
     try:
-        execute_db_query(
-            """
-            DELETE FROM tracking WHERE tracking_id = %s;
-            """,
-            (tracking_id,),
-            commit=True,
-        )
+        execute_db_query(DELETE_TRACKING_BY_ID, (tracking_id,), commit=True)
 
     except Exception as e:
         logging.error(
@@ -1390,47 +1698,36 @@ def _stop_tracking_logic(
 # Функции для запуска потоков отслеживания при перезапуске приложения
 def get_all_active_trackings():
     rows = execute_db_query(
-        """
-            SELECT
-                t.chat_id,
-                tr.train_number,
-                t.train_id,
-                tr.route_id,
-                r.url
-            FROM tracking t
-            JOIN trains tr ON t.train_id = tr.train_id
-            JOIN routes r ON tr.route_id = r.route_id
-
-        """,
+        GET_ALL_ACTIVE_TRACKINGS,
         fetchall=True,
         commit=True,
     )
     return rows
 
 
+# Активные отслеживания одного маршрута (для задачи опроса маршрута)
+def get_route_trackings(url):
+    try:
+        rows = execute_db_query(GET_ROUTE_TRACKINGS, (url,), fetchall=True)
+        return rows
+    except Exception as e:
+        logging.error(f"Database error in get_route_trackings: {str(e)}")
+        raise
+
+
 def restore_all_trackings():
     try:
         rows = async_db_call(get_all_active_trackings)
         if not rows:
             logging.info("Нет активных отслеживаний для восстановления.")
-            return
-        for row in rows:
-            chat_id = row[0]
-            train_tracking = row[1]
-            train_id = row[2]
-            route_id = row[3]
-            url = row[4]
-
-            thread = threading.Thread(
-                target=tracking_loop,
-                args=(chat_id, train_tracking, train_id, route_id, url),
-                name=f"tracking_{train_tracking}_{chat_id}",
-                daemon=True,
-            )
-            thread.start()
+        else:
+            routes = group_trackings_by_route(rows)
             logging.info(
-                f"Восстановлено отслеживание: {train_tracking} для {chat_id}"
+                f"Восстановлено {len(rows)} отслеживаний "
+                f"на {len(routes)} маршрутах"
             )
+        # Отслеживания обслуживает планировщик с пулом потоков
+        start_tracking_scheduler()
 
     except Exception as e:
         logging.error(
@@ -1624,12 +1921,10 @@ def normalize_date(date_str):
     elif date_str == "Завтра":
         return datetime.today().date() + timedelta(days=1)
     if not date_str or not isinstance(date_str, str):
-        raise ValueError(
-            f"Неверный формат.\n\
+        raise ValueError(f"Неверный формат.\n\
 Примеры: {today.strftime('%Y-%m-%d')}, \
 {today.strftime('%d %m %Y')}, \
-{today.strftime('%Y %m %d')}"
-        )
+{today.strftime('%Y %m %d')}")
 
     for fmt in formats:
         try:
@@ -1655,104 +1950,46 @@ def normalize_date(date_str):
             continue
 
     # Если ни один формат не подошёл:
-    raise ValueError(
-        f"Неверный формат.\n\
+    raise ValueError(f"Неверный формат.\n\
 Примеры: {today.strftime('%Y-%m-%d')}, \
 {today.strftime('%d %m %Y')}, \
-{today.strftime('%Y %m %d')}"
-    )
-
-
-# Проверка наличия места
-def check_tickets_by_class(train_number, soup, chat_id):
-    train_info = soup.select(
-        f'div.sch-table__row[data-train-number^="{train_number}"]'
-    )
-    try:
-        selling_allowed = train_info[0]["data-ticket_selling_allowed"]
-    except IndexError:
-        selling_allowed = "none"
-
-    if selling_allowed == "true":
-        return get_tickets_by_class(train_number, soup)
-    elif selling_allowed == "false":
-        return "Мест нет либо закрыта продажа"
-    else:
-        return "Ошибка получения информации о поезде"
+{today.strftime('%Y %m %d')}")
 
 
-# Получение количества мест
-def get_tickets_by_class(train_number, soup):
-    # информация о наличии мест и классов вагонов
-    train_info = soup.select(
-        f'div.sch-table__row[data-train-number^="{train_number}"]'
-    )
-    # доступные классы вагонов и места
-    class_names = train_info[0].find_all(
-        class_="sch-table__t-quant js-train-modal dash"
-    )
-    # вывод словаря с заменой номера на имя класса обслуживания
-    # и общего количества мест для каждого класса
-    tickets_by_class = {}
-    for class_n in class_names:
-        name = seats_type_dict[class_n["data-car-type"]]  # type: ignore
-        try:
-            seats_num = int(class_n.select_one("span").text)  # type: ignore
-        except ValueError:
-            seats_num = "Без нумерации мест"
-            tickets_by_class[name] = "\u221e"
-            continue
-        if name in tickets_by_class:
-            tickets_by_class[name] += seats_num
-        else:
-            tickets_by_class[name] = seats_num
-    return tickets_by_class
+# Проверка наличия места: вектор мест поезда (seat_vector)
+def check_tickets_by_class(train_number, trains, chat_id):
+    return seat_vector(find_train(trains, train_number))
 
 
 # Проверка времени (прекратить отслеживание за 15 минут до отправления)
-def check_depart_time(train_number, soup, train_id):
-    # информация о наличии мест и классов вагонов
-    train_info = soup.select(
-        f'div.sch-table__row[data-train-number^="{train_number}"] \
-            div.sch-table__time.train-from-time'
-    )
+# route_date - дата маршрута (routes.date, YYYY-MM-DD) из строки
+# отслеживания; None - при выборе поезда, до начала отслеживания
+def check_depart_time(train_number, trains, route_date=None):
+    # время до отправления со страницы маршрута
+    seconds_to_depart = departure_seconds(trains, train_number)
     logging.info(
-        f"FG check_depart_time (train_number, train_id, train_info) \n"
-        f"{train_number, ' ',  train_id, '\n', train_info}"
+        f"FG check_depart_time (train_number, route_date, seconds) \n"
+        f"{train_number, route_date, seconds_to_depart}"
     )
+    # Время есть на странице - дата маршрута не нужна
+    if seconds_to_depart is not None:
+        return seconds_to_depart
     # Сравнение текущей даты с датой отправления
-    # Если даты совпадают, а train_info пустой == ошибка сайта
+    # Если даты совпадают, а данных о поезде нет == ошибка сайта
     # Такие сложности из-за особености сайта: если поезд сегодня
     # но уже отправился, то будет время в секундах с минусом.
     # Если дата прошла, то данных не будет вовсе
-    # Получение даты отправления (работает уже в цикле отслеживания
-    # и не работает когда только начинается отслеживание - train_id=None):
-    resp_db = execute_db_query(
-        """
-            SELECT r.date FROM trains t
-            JOIN routes r ON t.route_id = r.route_id
-            WHERE train_id = %s
-            """,
-        (train_id,),
-        fetchone=True,
-    )
-    if resp_db:
-        depart_time = datetime.strptime(resp_db[0], "%Y-%m-%d").date()
+    if route_date:
+        depart_time = datetime.strptime(route_date, "%Y-%m-%d").date()
     else:
         depart_time = datetime(2000, 1, 1).date()
     today = datetime.today().date()
 
     # Если дата уже прошла вызвать 0. Если сбой информации не будет.
-
-    if not train_info and (depart_time >= today):
+    if depart_time >= today:
         raise SiteResponseError('Ошибка получения данных поезда с сайта')
-    elif not train_info and depart_time < today:
-        # Условие важно особенно на стыке суток
-        result = 0
-    else:
-        # время до отправления в секундах
-        result = int(train_info[0]["data-value"])
-    return result
+    # Условие важно особенно на стыке суток
+    return 0
 
 
 # ============================================================================
@@ -1760,75 +1997,121 @@ def check_depart_time(train_number, soup, train_id):
 
 
 # Удаление прошедших маршрутов из таблицы routes
+# Выполняется прямо в этом потоке (своё соединение из пула), а не в потоках
+# DbExecutor, чтобы не задерживать запросы пользователей
 def cleanup_expired_routes():
     while True:
         try:
-            async_db_call(_cleanup_logic)
+            _cleanup_logic()
         except Exception:
-            raise
+            # Ошибка уже в журнале; повтор - в следующем цикле
+            pass
         # Проверяем каждые 2 часа
         time.sleep(2 * 60 * 60)
 
 
+# Итоги последней очистки (для collect_stats)
+last_cleanup = {}
+
+
+# Удаление пачками по cleanup_batch_size маршрутов, каждая пачка -
+# отдельная короткая транзакция. Со схемой версии CASCADE_VERSION
+# поезда и отслеживания удаляются вместе с маршрутом (ON DELETE CASCADE),
+# иначе - явно, в той же транзакции, до маршрутов
 def _cleanup_logic():
     try:
         # Текущая дата
         yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        # Находим маршруты с прошедшей датой
-        expired_routes = execute_db_query(
-            """
-            SELECT route_id FROM routes
-            WHERE date < %s
-            """,
-            (yesterday,),
-            fetchall=True,
-        )
-        if expired_routes:
-            # Удаляем связанные записи из tracking
-            execute_db_query(
-                """
-                DELETE FROM tracking
-                WHERE train_id IN (
-                    SELECT train_id FROM trains
-                    WHERE route_id IN (
-                        SELECT route_id FROM routes
-                        WHERE date < %s
-                    )
-                )
-                """,
-                (yesterday,),
-                commit=True,
-            )
-
-            # Удаляем поезда
-            execute_db_query(
-                """
-                DELETE FROM trains
-                WHERE route_id IN (
-                    SELECT route_id FROM routes
-                    WHERE date < %s
+        start = time.monotonic()
+        # Удалено строк: маршрутов, поездов, отслеживаний
+        removed = [0, 0, 0]
+        batches = 0
+        with db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cascade = applied_version(cursor) >= CASCADE_VERSION
+            conn.commit()
+            if not cascade:
+                logging.error(
+                    f"Схема БД ниже версии {CASCADE_VERSION} (нет каскадного "
+                    f"удаления): поезда и отслеживания удаляются явно. "
+                    f"Выполните python schema.py migrate"
                 )
-                """,
-                (yesterday,),
-                commit=True,
-            )
-
-            # Удаляем сами маршруты
-            execute_db_query(
-                """
-                DELETE FROM routes
-                WHERE date < %s
-                """,
-                (yesterday,),
-                commit=True,
+            delete_batch = (
+                _delete_routes_cascade if cascade else _delete_routes_explicit
             )
-
-            logging.info(f"Удалено {len(expired_routes)} устаревших маршрутов")
+            while True:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        SELECT_EXPIRED_ROUTES, (yesterday, cleanup_batch_size)
+                    )
+                    route_ids = [row[0] for row in cursor.fetchall()]
+                    deleted = (
+                        delete_batch(cursor, route_ids)
+                        if route_ids
+                        else (0, 0, 0)
+                    )
+                conn.commit()
+                removed = [a + b for a, b in zip(removed, deleted)]
+                batches += 1
+                if len(route_ids) < cleanup_batch_size:
+                    break
+        elapsed = time.monotonic() - start
+        routes, trains, trackings = removed
+        last_cleanup.update(
+            routes_removed=routes,
+            trains_removed=trains,
+            tracking_removed=trackings,
+            batches=batches,
+            cascade=cascade,
+            seconds=round(elapsed, 3),
+            finished_at=datetime.now().isoformat(timespec="seconds"),
+        )
+        logging.info(
+            f"Удалено {routes} устаревших маршрутов, {trains} поездов, "
+            f"{trackings} отслеживаний ({batches} пачек) за {elapsed:.3f} сек"
+        )
     except Exception as e:
         logging.error(f"Database error in cleanup_expired_routes: {str(e)}")
         raise
 
 
+# Удаление заблокированной пачки маршрутов; поезда и отслеживания -
+# каскадно (считаются до удаления).
+# Возвращает число удалённых маршрутов, поездов и отслеживаний
+def _delete_routes_cascade(cursor, route_ids):
+    cursor.execute(COUNT_ROUTES_DEPENDENTS, (route_ids, route_ids))
+    trains, trackings = cursor.fetchone()
+    cursor.execute(DELETE_ROUTES, (route_ids,))
+    return cursor.rowcount, trains, trackings
+
+
+# Удаление пачки маршрутов без каскадных внешних ключей: сначала
+# отслеживания, затем поезда и маршруты
+def _delete_routes_explicit(cursor, route_ids):
+    cursor.execute(DELETE_ROUTES_TRACKING, (route_ids,))
+    trackings = cursor.rowcount
+    cursor.execute(DELETE_ROUTES_TRAINS, (route_ids,))
+    trains = cursor.rowcount
+    cursor.execute(DELETE_ROUTES, (route_ids,))
+    return cursor.rowcount, trains, trackings
+
+
+# Сводка метрик процесса
+def collect_stats():
+    return {
+        "rate_limiter": limiter_stats(),
+        "circuit_breaker": breaker_stats(),
+        "route_cache": route_cache.stats(),
+        "tracking_scheduler": tracking_scheduler.stats(),
+        "polling_policy": polling_policy.stats(),
+        "async_engine": async_tracking_engine.stats(),
+        "parse_pool": parse_pool.stats(),
+        "db_pool": db_pool.stats(),
+        "db_executor": db_executor.stats(),
+        "route_cleanup": dict(last_cleanup),
+    }
+
+
 # Отслеживание работающих потоков каждые 30 мин
 def monitor_threads_track():
     while True:
@@ -1837,6 +2120,7 @@ def monitor_threads_track():
         ]
 
         logging.info(f"Active threads: {len(active_threads)}")
+        logging.info(f"Stats: {collect_stats()}")
         for t in active_threads:
             logging.info(f"Thread {t} is alive")
         time.sleep(1800)
@@ -1918,7 +2202,7 @@ def confirm_stop(call):
     # всех поездов в False
     # после остановки поездов, удалить всю сессию
 
-    async_db_call(_confirm_stop_logic, chat_id)
+    async_db_call(_confirm_stop_logic, chat_id, order_key=chat_id)
     del_user_data(chat_id)
     bot.send_message(chat_id, "🛑 Бот остановлен")
 
@@ -1926,24 +2210,10 @@ def confirm_stop(call):
 def _confirm_stop_logic(chat_id):
     try:
         # Удалить все записи отслеживания пользователя
-        execute_db_query(
-            """
-            DELETE FROM tracking
-            WHERE chat_id = %s
-            """,
-            (chat_id,),
-            commit=True,
-        )
+        execute_db_query(DELETE_USER_TRACKINGS, (chat_id,), commit=True)
 
         # Удалить самого пользователя
-        execute_db_query(
-            """
-            DELETE FROM users
-            WHERE chat_id = %s
-            """,
-            (chat_id,),
-            commit=True,
-        )
+        execute_db_query(DELETE_USER, (chat_id,), commit=True)
         logging.info(
             f"Бот остановлен chat_id: {chat_id}." f"Список отслеживания очищен"
         )
@@ -1958,17 +2228,11 @@ def exit_admin(message):
     chat_id = message.chat.id
 
     with db_lock:
-        try:
-            conn = db_pool.getconn()
-            cursor = conn.cursor()
-            cursor.execute(
-                "DELETE FROM tracking WHERE chat_id = %s", (chat_id,)
-            )
-            cursor.execute("DELETE FROM users WHERE chat_id = %s", (chat_id,))
+        with db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(DELETE_USER_TRACKINGS, (chat_id,))
+                cursor.execute(DELETE_USER, (chat_id,))
             conn.commit()
-        finally:
-            cursor.close()
-            conn.close()
 
     bot.send_message(chat_id, "Выход из ПО")
 
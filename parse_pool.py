@@ -0,0 +1,103 @@
+import atexit
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from route_parser import parse_route_page, parser_backend
+from token_info import parse_processes, parse_timeout
+
+
+class ParsePool:
+    """
+    Разбор страниц маршрутов в отдельных процессах (PARSE_PROCESSES > 0).
+    Поток, получивший страницу, передаёт байты тела и ждёт записи поездов,
+    не занимая GIL: обработчики webhook в это время продолжают работать.
+    Процессы создаются fork-ом сразу при импорте модуля, пока в процессе
+    ещё нет других потоков (spawn заново выполнил бы main.py в каждом
+    процессе). Если пул сломался или закрыт, он отключается и страница
+    разбирается в текущем потоке; разбор дольше timeout дожидается процесса
+    (учитывается в stats()["slow"]).
+    """
+
+    def __init__(self, processes=0, timeout=10):
+        self.processes = processes
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._fallbacks = 0
+        self._slow = 0
+        self._broken = False
+
+    @property
+    def enabled(self):
+        return self._executor is not None
+
+    # Создание процессов (вызывать до запуска потоков)
+    def start(self):
+        if self.processes <= 0 or self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("fork"),
+        )
+        # Для fork процессы создаются при первой задаче
+        self._executor.submit(int).result()
+
+    # Разбор тела страницы: {номер поезда: TrainRecord}
+    def parse(self, body):
+        executor = self._executor
+        if executor is None:
+            return parse_route_page(body)
+        try:
+            # RuntimeError - пул уже закрыт (shutdown) или сломан
+            future = executor.submit(parse_route_page, body, parser_backend)
+            with self._lock:
+                self._submitted += 1
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                # Повторный разбор в потоке занял бы второе ядро, а новый
+                # пул fork-ом после запуска потоков не создать: ждём процесс
+                with self._lock:
+                    self._slow += 1
+                logging.warning(
+                    f"Разбор страницы в пуле дольше {self.timeout} сек"
+                )
+                return future.result()
+        except (BrokenProcessPool, RuntimeError) as e:
+            logging.error(f"Пул разбора страниц сломан и отключён: {e}")
+            self._broken = True
+            self.shutdown()
+        with self._lock:
+            self._fallbacks += 1
+        return parse_route_page(body)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "submitted": self._submitted,
+                "fallbacks": self._fallbacks,
+                "slow": self._slow,
+                "broken": self._broken,
+            }
+
+
+parse_pool = ParsePool(parse_processes, parse_timeout)
+parse_pool.start()
+atexit.register(parse_pool.shutdown)
+
+
+# Разбор тела страницы маршрута: в пуле процессов, если он включён
+def parse_route_body(body):
+    return parse_pool.parse(body)
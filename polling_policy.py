@@ -0,0 +1,74 @@
+import random
+import threading
+
+# Базовый интервал опроса (сек) в зависимости от времени до отправления:
+# (до отправления меньше, сек; интервал, сек)
+DEPARTURE_STEPS = (
+    (3 * 3600, 120),
+    (24 * 3600, 300),
+    (3 * 24 * 3600, 600),
+    (14 * 24 * 3600, 1200),
+)
+# Интервал, если до отправления больше двух недель или время неизвестно
+FAR_INTERVAL = 2400
+UNKNOWN_INTERVAL = 700
+
+
+class PollingPolicy:
+    """
+    Интервалы опроса маршрутов.
+    Чем ближе отправление, чем чаще менялись места (volatility 0..1)
+    и если мест почти нет - тем чаще опрос. Сумма запросов всех маршрутов
+    не превышает budget_per_minute: при нехватке бюджета все интервалы
+    растягиваются в одинаковое число раз.
+    """
+
+    def __init__(self, min_interval=120, max_interval=3600, budget=60):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget_per_minute = budget
+        self._intervals = {}  # ключ маршрута -> последний интервал
+        self._lock = threading.Lock()
+
+    def base_interval(self, seconds_to_depart):
+        if seconds_to_depart is None:
+            return UNKNOWN_INTERVAL
+        for limit, interval in DEPARTURE_STEPS:
+            if seconds_to_depart < limit:
+                return interval
+        return FAR_INTERVAL
+
+    # Во сколько раз растянуть интервалы, чтобы уложиться в бюджет
+    # Вызывается под self._lock
+    def _budget_scale(self):
+        demand = sum(60 / i for i in self._intervals.values())
+        return max(1.0, demand / self.budget_per_minute)
+
+    # Интервал до следующего опроса маршрута key, сек
+    def interval(self, key, seconds_to_depart, volatility=0.0, scarce=False):
+        interval = self.base_interval(seconds_to_depart)
+        # Частые изменения мест - до двух раз чаще
+        interval *= 1 - 0.5 * min(max(volatility, 0.0), 1.0)
+        # Мест нет или почти нет - ждём возвратов билетов
+        if scarce and seconds_to_depart is not None:
+            interval *= 0.5
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        with self._lock:
+            self._intervals[key] = interval
+            interval *= self._budget_scale()
+        # Разброс, чтобы маршруты не опрашивались синхронно
+        return interval * random.uniform(0.9, 1.1)
+
+    def forget(self, key):
+        with self._lock:
+            self._intervals.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            demand = sum(60 / i for i in self._intervals.values())
+            return {
+                "routes": len(self._intervals),
+                "demand_per_minute": round(demand, 2),
+                "budget_per_minute": self.budget_per_minute,
+                "scale": round(self._budget_scale(), 3),
+            }
@@ -0,0 +1,119 @@
+"""
+Запросы к БД, которые бот выполняет постоянно (обработчики команд,
+опрос маршрутов, сверка отслеживаний, очистка).
+
+Текст каждого запроса задан один раз: его выполняет main.py и по нему же
+schema.check_hot_queries() проверяет план (EXPLAIN).
+"""
+
+CHECK_USER_EXISTS = "SELECT EXISTS(SELECT 1 FROM users WHERE chat_id = %s)"
+
+GET_ROUTE_ID = "SELECT route_id FROM routes WHERE url = %s"
+
+GET_ROUTE_TRAINS = """
+    SELECT train_number, time_depart, time_arriv FROM trains
+    WHERE route_id = %s
+    ORDER BY time_depart
+"""
+
+GET_TRAIN_ID = """
+    SELECT t.train_id FROM trains t
+    JOIN routes r ON r.route_id = t.route_id
+    WHERE r.url = %s AND t.train_number = %s
+    LIMIT 1
+"""
+
+# Отслеживается ли поезд пользователем и сколько у него отслеживаний
+GET_TRACKING_STATUS = """
+    SELECT
+    EXISTS (
+        SELECT 1 FROM tracking
+        WHERE chat_id = %s AND train_id = %s
+    ),
+    (SELECT COUNT(*) FROM tracking WHERE chat_id = %s)
+"""
+
+GET_TRACK_LIST = """
+    SELECT tracking_id, t.train_number,
+           r.city_from, r.city_to, r.date, t.time_depart
+    FROM tracking tr
+    JOIN trains t ON tr.train_id = t.train_id
+    JOIN routes r ON t.route_id = r.route_id
+    WHERE tr.chat_id = %s
+"""
+
+UPDATE_TRACKING = """
+    UPDATE tracking
+    SET json_ticket_dict = %s
+    WHERE chat_id = %s AND train_id = %s
+"""
+
+# Все отслеживания (сверка задач опроса маршрутов)
+GET_ALL_ACTIVE_TRACKINGS = """
+    SELECT
+        t.chat_id,
+        tr.train_number,
+        t.train_id,
+        tr.route_id,
+        r.url
+    FROM tracking t
+    JOIN trains tr ON t.train_id = tr.train_id
+    JOIN routes r ON tr.route_id = r.route_id
+"""
+
+# Отслеживания одного маршрута (задача опроса маршрута)
+GET_ROUTE_TRACKINGS = """
+    SELECT
+        t.chat_id,
+        tr.train_number,
+        t.train_id,
+        tr.route_id,
+        r.url,
+        t.json_ticket_dict,
+        r.date
+    FROM tracking t
+    JOIN trains tr ON t.train_id = tr.train_id
+    JOIN routes r ON tr.route_id = r.route_id
+    WHERE r.url = %s
+"""
+
+DELETE_TRACKING = """
+    DELETE FROM tracking
+    WHERE chat_id = %s AND train_id = %s
+"""
+
+DELETE_TRACKING_BY_ID = "DELETE FROM tracking WHERE tracking_id = %s"
+
+DELETE_USER_TRACKINGS = "DELETE FROM tracking WHERE chat_id = %s"
+
+DELETE_USER = "DELETE FROM users WHERE chat_id = %s"
+
+# Очистка: пачка маршрутов с датой раньше заданной (строки блокируются
+# до конца транзакции), затем их отслеживания, поезда и сами маршруты.
+# Со схемой CASCADE_VERSION поезда и отслеживания удаляются вместе
+# с маршрутом, их число считается до удаления
+SELECT_EXPIRED_ROUTES = """
+    SELECT route_id FROM routes WHERE date < %s
+    ORDER BY route_id LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+COUNT_ROUTES_DEPENDENTS = """
+    SELECT
+    (SELECT COUNT(*) FROM trains WHERE route_id = ANY(%s)),
+    (
+        SELECT COUNT(*) FROM tracking WHERE train_id IN (
+            SELECT train_id FROM trains WHERE route_id = ANY(%s)
+        )
+    )
+"""
+
+DELETE_ROUTES_TRACKING = """
+    DELETE FROM tracking WHERE train_id IN (
+        SELECT train_id FROM trains WHERE route_id = ANY(%s)
+    )
+"""
+
+DELETE_ROUTES_TRAINS = "DELETE FROM trains WHERE route_id = ANY(%s)"
+
+DELETE_ROUTES = "DELETE FROM routes WHERE route_id = ANY(%s)"
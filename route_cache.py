@@ -0,0 +1,243 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+from parse_pool import parse_pool, parse_route_body
+from route_parser import ENCODING, RouteStreamParser
+from site_client import RateLimitWaitError, fetch, route_headers
+from token_info import route_cache_size, route_cache_ttl
+
+
+# Полученная страница маршрута. Тело хранится байтами (content),
+# text декодирует его только по требованию
+class CachedPage:
+    __slots__ = (
+        "url",
+        "status_code",
+        "content",
+        "headers",
+        "fetched_at",
+        "elapsed",
+        "trains",
+        "partial",
+    )
+
+    def __init__(
+        self,
+        url,
+        status_code,
+        content,
+        headers,
+        elapsed=0.0,
+        trains=None,
+        partial=False,
+    ):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.fetched_at = time.time()
+        self.elapsed = elapsed  # время ответа сайта, сек
+        # {номер поезда: TrainRecord}, если страница уже разобрана
+        self.trains = trains
+        # Тело прочитано не до конца (только до нужных поездов),
+        # в общий кэш такая страница не попадает
+        self.partial = partial
+
+    @property
+    def text(self):
+        return self.content.decode(ENCODING, "replace")
+
+    def age(self):
+        return time.time() - self.fetched_at
+
+    # Поезда страницы: разобранные при загрузке или разбор тела сейчас
+    def parsed_trains(self):
+        if self.trains is None:
+            self.trains = parse_route_body(self.content)
+        return self.trains
+
+
+# Запрос, который уже выполняется другим потоком
+class _Flight:
+    __slots__ = ("event", "page", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.page = None
+        self.error = None
+
+
+# Канонический вид URL маршрута: один ключ для одинаковых запросов
+# с разным порядком параметров и кодированием кириллицы
+def canonical_route_url(url):
+    parts = urlsplit(url)
+    query = sorted(parse_qsl(parts.query, keep_blank_values=True))
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            parts.path or "/",
+            urlencode(query, quote_via=quote),
+            "",
+        )
+    )
+
+
+class RouteCache:
+    """
+    Кэш страниц маршрутов для всего процесса.
+    Страница считается свежей ttl секунд, размер ограничен max_entries
+    (вытесняется давно не использованная). Одновременные промахи по одному
+    URL выполняют один запрос на сайт, остальные потоки ждут его результат.
+    В кэш попадают только ответы с кодом 200.
+    """
+
+    def __init__(self, ttl=60, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> CachedPage
+        self._inflight = {}  # key -> _Flight
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+
+    # Свежая страница из кэша или None
+    def peek(self, url, max_age=None):
+        max_age = self.ttl if max_age is None else max_age
+        key = canonical_route_url(url)
+        with self._lock:
+            page = self._entries.get(key)
+            if page is None or page.age() > max_age:
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return page
+
+    def put(self, page):
+        if page.status_code != 200 or page.partial:
+            return
+        key = canonical_route_url(page.url)
+        with self._lock:
+            self._entries[key] = page
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, url):
+        with self._lock:
+            self._entries.pop(canonical_route_url(url), None)
+
+    # Страница из кэша или с сайта через loader(url) -> CachedPage.
+    # max_wait - сколько ждать запрос другого потока (RateLimitWaitError)
+    def get(self, url, loader, max_age=None, max_wait=None):
+        page = self.peek(url, max_age)
+        if page is not None:
+            return page
+
+        key = canonical_route_url(url)
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+                self._misses += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            if not flight.event.wait(max_wait):
+                raise RateLimitWaitError(max_wait)
+            if flight.error is not None:
+                raise flight.error
+            if flight.page.status_code == 200 and not flight.page.partial:
+                return flight.page
+            # Ответ лидера не для общего пользования
+            # (304 или страница, разобранная только до нужных поездов)
+            return loader(url)
+
+        try:
+            flight.page = loader(url)
+            self.put(flight.page)
+            return flight.page
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "evictions": self._evictions,
+            }
+
+
+route_cache = RouteCache(ttl=route_cache_ttl, max_entries=route_cache_size)
+
+
+# Загрузка страницы маршрута с сайта. Тело не декодируется: байты
+# по мере получения передаются в парсер, разбор идёт вместе с загрузкой.
+# targets - номера нужных поездов: чтение прекращается, как только
+# их строки получены (страница partial, в кэш не кладётся).
+# С пулом процессов разбора (PARSE_PROCESSES) тело читается целиком
+# и разбирается в пуле
+def load_route_page(url, headers=None, targets=None, max_wait=None):
+    parser = None if parse_pool.enabled else RouteStreamParser(targets=targets)
+    r = fetch(
+        url,
+        headers=headers or route_headers(url),
+        on_chunk=parser.feed if parser is not None else None,
+        max_wait=max_wait,
+    )
+    logging.debug(
+        f"GET {url} -> {r.status_code} "
+        f"за {r.elapsed.total_seconds():.3f} сек"
+    )
+    trains = None
+    if r.status_code == 200 and parser is None:
+        trains = parse_route_body(r.content)
+    elif r.status_code == 200:
+        try:
+            trains = parser.close()
+            if trains is None:
+                # bs4 или нужных строк нет: тело получено целиком
+                trains = parse_route_body(r.content)
+        except Exception as e:
+            # Разберётся заново из content при обращении
+            logging.warning(f"Потоковый разбор {url} не удался: {e}")
+    return CachedPage(
+        url,
+        r.status_code,
+        r.content,
+        r.headers,
+        elapsed=r.elapsed.total_seconds(),
+        trains=trains,
+        partial=parser is not None and parser.done,
+    )
+
+
+# Страница маршрута через общий кэш.
+# targets - см. load_route_page (только для опроса отслеживаний),
+# max_wait - см. site_client.fetch (для запросов пользователя)
+def get_route_page(
+    url, headers=None, max_age=None, targets=None, max_wait=None
+):
+    return route_cache.get(
+        url,
+        lambda u: load_route_page(u, headers, targets, max_wait),
+        max_age=max_age,
+        max_wait=max_wait,
+    )
@@ -0,0 +1,421 @@
+import hashlib
+import logging
+import time
+from typing import NamedTuple, Optional
+
+from bs4 import BeautifulSoup
+
+# Для парсинга страниц
+from bs4.filter import SoupStrainer
+from lxml import etree
+
+from token_info import parser_backend
+
+# Кодировка страниц сайта (в заголовках ответа она указана не всегда)
+ENCODING = "utf-8"
+
+# Ячейка класса вагона с числом мест
+SEATS_CLASS = "sch-table__t-quant js-train-modal dash"
+
+
+# Данные одного поезда со страницы маршрута
+class TrainRecord(NamedTuple):
+    number: str
+    time_depart: str
+    time_arriv: str
+    # "true" / "false" из data-ticket_selling_allowed, "none" - нет атрибута
+    selling_allowed: str
+    # ((data-car-type, мест), ...) в порядке страницы, места суммированы
+    # по классу; None - места без нумерации
+    seats: tuple
+    # Секунды до отправления (data-value), None - нет данных
+    seconds_to_depart: Optional[int]
+
+
+def _text(tag, default="Нет данных"):
+    return tag.text.strip() if tag is not None else default
+
+
+# Неизменяемый снимок страницы маршрута для сессии пользователя:
+# записи поездов в порядке страницы и время получения страницы.
+# Поиск поезда - как у словаря {номер: TrainRecord} (get, items).
+# Копирование (copy/deepcopy сессии) возвращает тот же объект
+class RouteSnapshot:
+    __slots__ = ("url", "fetched_at", "trains", "_by_number")
+
+    def __init__(self, url, trains, fetched_at=None):
+        # trains - {номер: TrainRecord} или последовательность TrainRecord
+        records = tuple(
+            trains.values() if isinstance(trains, dict) else trains
+        )
+        set_attr = object.__setattr__
+        set_attr(self, "url", url)
+        set_attr(self, "trains", records)
+        set_attr(
+            self,
+            "fetched_at",
+            time.time() if fetched_at is None else fetched_at,
+        )
+        set_attr(self, "_by_number", {r.number: r for r in records})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RouteSnapshot is immutable")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __len__(self):
+        return len(self.trains)
+
+    def __iter__(self):
+        return iter(self.trains)
+
+    def __repr__(self):
+        return (
+            f"RouteSnapshot({self.url!r}, {len(self.trains)} trains, "
+            f"age {self.age():.0f}s)"
+        )
+
+    def get(self, train_number, default=None):
+        return self._by_number.get(train_number, default)
+
+    def items(self):
+        return self._by_number.items()
+
+    def age(self):
+        return time.time() - self.fetched_at
+
+
+# ----------------------------------------------------------------------------
+# BeautifulSoup (эталонная реализация)
+
+
+# Разбор одной строки таблицы поездов
+def _parse_row(row):
+    number_tag = row.find("span", class_="train-number")
+    number = (
+        number_tag.text
+        if number_tag is not None
+        else row.get("data-train-number", "")
+    )
+
+    seats = {}
+    for cell in row.find_all(class_=SEATS_CLASS):
+        car_type = cell.get("data-car-type")
+        if car_type is None:
+            continue
+        span = cell.find("span")
+        try:
+            count = int(span.text)  # type: ignore
+        except (AttributeError, ValueError):
+            # Места без нумерации
+            seats[car_type] = None
+            continue
+        if car_type in seats:
+            if seats[car_type] is not None:
+                seats[car_type] += count
+        else:
+            seats[car_type] = count
+
+    from_time = row.find("div", class_="train-from-time")
+    try:
+        seconds_to_depart = int(from_time["data-value"])  # type: ignore
+    except (TypeError, KeyError, ValueError):
+        seconds_to_depart = None
+
+    return TrainRecord(
+        number=number,
+        time_depart=_text(row.find(attrs={"data-sort": "departure"})),
+        time_arriv=_text(row.find(attrs={"data-sort": "arrival"})),
+        selling_allowed=row.get("data-ticket_selling_allowed", "none"),
+        seats=tuple(seats.items()),
+        seconds_to_depart=seconds_to_depart,
+    )
+
+
+# Все поезда страницы за один проход по строкам sch-table__row:
+# {номер поезда: TrainRecord} в порядке страницы
+def extract_trains(soup):
+    trains = {}
+    for row in soup.find_all("div", class_="sch-table__row"):
+        if not row.has_attr("data-train-number"):
+            continue
+        record = _parse_row(row)
+        # Первая строка с номером - как у поиска по селектору
+        trains.setdefault(record.number, record)
+    return trains
+
+
+# Дерево страницы маршрута (только теги span и div).
+# text - байты ответа в ENCODING или уже декодированная строка
+def parse_route_soup(text):
+    only_span_div_tag = SoupStrainer(["span", "div"])
+    if isinstance(text, (bytes, bytearray)):
+        return BeautifulSoup(
+            text,
+            "lxml",
+            parse_only=only_span_div_tag,
+            from_encoding=ENCODING,
+        )
+    return BeautifulSoup(text, "lxml", parse_only=only_span_div_tag)
+
+
+# Разбор страницы маршрута через BeautifulSoup
+def parse_route_page_bs4(text):
+    return extract_trains(parse_route_soup(text))
+
+
+# ----------------------------------------------------------------------------
+# lxml: скомпилированные XPath-выражения без построения дерева bs4.
+# Выборки повторяют поиск BeautifulSoup: class_="x" - совпадение одного
+# из классов, class_="a b c" - совпадение всего атрибута
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+_XP_ROWS = etree.XPath(
+    f"//div[{_has_class('sch-table__row')}][@data-train-number]"
+)
+_XP_NUMBER = etree.XPath(f"(.//span[{_has_class('train-number')}])[1]")
+_XP_DEPARTURE = etree.XPath("(.//*[@data-sort='departure'])[1]")
+_XP_ARRIVAL = etree.XPath("(.//*[@data-sort='arrival'])[1]")
+_XP_SEATS = etree.XPath(f".//*[@class='{SEATS_CLASS}']")
+_XP_SEATS_NUM = etree.XPath("(.//span)[1]")
+_XP_FROM_TIME = etree.XPath(f"(.//div[{_has_class('train-from-time')}])[1]")
+
+_HTML_PARSER = etree.HTMLParser(encoding=ENCODING)
+
+
+def _first(xpath, element):
+    found = xpath(element)
+    return found[0] if found else None
+
+
+# Весь текст элемента, как .text у BeautifulSoup
+def _all_text(element):
+    return "".join(element.itertext())
+
+
+def _text_lxml(element, default="Нет данных"):
+    if element is None:
+        return default
+    return _all_text(element).strip()
+
+
+# Разбор одной строки таблицы поездов (аналог _parse_row)
+def _parse_row_lxml(row):
+    number_tag = _first(_XP_NUMBER, row)
+    number = (
+        _all_text(number_tag)
+        if number_tag is not None
+        else row.get("data-train-number", "")
+    )
+
+    seats = {}
+    for cell in _XP_SEATS(row):
+        car_type = cell.get("data-car-type")
+        if car_type is None:
+            continue
+        span = _first(_XP_SEATS_NUM, cell)
+        try:
+            count = int(_all_text(span))  # type: ignore
+        except (AttributeError, ValueError):
+            # Места без нумерации
+            seats[car_type] = None
+            continue
+        if car_type in seats:
+            if seats[car_type] is not None:
+                seats[car_type] += count
+        else:
+            seats[car_type] = count
+
+    from_time = _first(_XP_FROM_TIME, row)
+    try:
+        seconds_to_depart = int(from_time.get("data-value"))  # type: ignore
+    except (AttributeError, TypeError, ValueError):
+        seconds_to_depart = None
+
+    return TrainRecord(
+        number=number,
+        time_depart=_text_lxml(_first(_XP_DEPARTURE, row)),
+        time_arriv=_text_lxml(_first(_XP_ARRIVAL, row)),
+        selling_allowed=row.get("data-ticket_selling_allowed", "none"),
+        seats=tuple(seats.items()),
+        seconds_to_depart=seconds_to_depart,
+    )
+
+
+def _extract_trains_lxml(root):
+    trains = {}
+    if root is None:
+        return trains
+    for row in _XP_ROWS(root):
+        record = _parse_row_lxml(row)
+        trains.setdefault(record.number, record)
+    return trains
+
+
+# Разбор страницы маршрута через lxml (байты в ENCODING или строка)
+def parse_route_page_lxml(text):
+    if isinstance(text, str):
+        # lxml не принимает str с объявлением кодировки
+        text = text.encode(ENCODING)
+    root = etree.fromstring(text, _HTML_PARSER) if text.strip() else None
+    return _extract_trains_lxml(root)
+
+
+# ----------------------------------------------------------------------------
+# Выбор реализации
+
+PARSER_BACKENDS = {
+    "bs4": parse_route_page_bs4,
+    "lxml": parse_route_page_lxml,
+}
+
+if parser_backend not in PARSER_BACKENDS:
+    logging.warning(
+        f"Неизвестный PARSER_BACKEND={parser_backend}, используется lxml"
+    )
+    parser_backend = "lxml"
+
+
+# Разбор страницы маршрута в {номер поезда: TrainRecord}.
+# backend - имя реализации из PARSER_BACKENDS (по умолчанию PARSER_BACKEND)
+def parse_route_page(text, backend=None):
+    return PARSER_BACKENDS[backend or parser_backend](text)
+
+
+class RouteStreamParser:
+    """
+    Разбор страницы маршрута по мере получения ответа: feed(chunk) для
+    каждого куска байтов, close() -> {номер поезда: TrainRecord}.
+    lxml строит дерево инкрементально, пока тело ещё загружается.
+    Куски тела не сохраняются (их хранит вызывающий код): close()
+    возвращает None, если страницу нужно разобрать целиком по всему телу -
+    для bs4 и если нужных строк на странице не оказалось.
+
+    targets - номера нужных поездов (только lxml): строки таблицы
+    разбираются по событиям парсера, остальные сразу очищаются.
+    feed() возвращает True, когда все нужные строки найдены и тело можно
+    дальше не разбирать.
+    """
+
+    def __init__(self, backend=None, targets=None):
+        self.backend = backend or parser_backend
+        self.targets = frozenset(targets or ()) or None
+        self.done = False
+        self._parser = None
+        self._found = {}
+        if self.backend == "lxml" and self.targets:
+            self._parser = etree.HTMLPullParser(
+                events=("end",), tag="div", encoding=ENCODING
+            )
+        elif self.backend == "lxml":
+            self.targets = None
+            self._parser = etree.HTMLParser(encoding=ENCODING)
+        else:
+            self.targets = None
+        self._empty = True
+
+    def feed(self, chunk):
+        if not chunk or self.done:
+            return self.done
+        self._empty = False
+        if self._parser is not None:
+            self._parser.feed(chunk)
+        if self.targets:
+            self._read_rows()
+        return self.done
+
+    # Строки таблицы, закрытые в уже полученной части страницы
+    def _read_rows(self):
+        for _, element in self._parser.read_events():
+            if element.get("data-train-number") is None or (
+                "sch-table__row" not in element.get("class", "").split()
+            ):
+                continue
+            record = _parse_row_lxml(element)
+            element.clear()
+            if self._is_target(record.number):
+                self._found.setdefault(record.number, record)
+        self.done = all(
+            any(n.startswith(target) for n in self._found)
+            for target in self.targets
+        )
+
+    def _is_target(self, number):
+        return any(number.startswith(target) for target in self.targets)
+
+    def close(self):
+        if self.targets:
+            # Нужные строки не найдены - разбор всей страницы
+            return self._found if self.done else None
+        if self._parser is None:
+            return None
+        if self._empty:
+            return {}
+        return _extract_trains_lxml(self._parser.close())
+
+
+# Места поезда: продажа разрешена и места по классам
+def seat_state(record):
+    return record.selling_allowed, record.seats
+
+
+# Поезда, у которых места изменились между двумя разборами маршрута
+# (previous = None - прошлого разбора нет, изменились все)
+def diff_trains(previous, current):
+    if previous is None:
+        return set(current)
+    changed = set()
+    for number, record in current.items():
+        before = previous.get(number)
+        if before is None or seat_state(before) != seat_state(record):
+            changed.add(number)
+    return changed
+
+
+# Отпечаток данных поездов (без обратного отсчёта секунд до отправления).
+# Для неполных страниц, где отпечаток тела зависит от места обрыва
+def trains_fingerprint(trains):
+    data = repr(
+        sorted(
+            record._replace(seconds_to_depart=None)
+            for record in trains.values()
+        )
+    )
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+# Расхождения реализаций разбора на одной странице:
+# {номер поезда: {имя реализации: TrainRecord или None}}
+def backend_differences(text):
+    results = {name: parse(text) for name, parse in PARSER_BACKENDS.items()}
+    numbers = []
+    for trains in results.values():
+        numbers.extend(n for n in trains if n not in numbers)
+    differences = {}
+    for number in numbers:
+        records = {
+            name: trains.get(number) for name, trains in results.items()
+        }
+        if len(set(records.values())) > 1:
+            differences[number] = records
+    return differences
+
+
+# Поиск поезда по номеру. Как и data-train-number^= в прежних селекторах,
+# допускает номер-префикс
+def find_train(trains, train_number):
+    record = trains.get(train_number)
+    if record is not None:
+        return record
+    for number, record in trains.items():
+        if number.startswith(train_number):
+            return record
+    return None
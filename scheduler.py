@@ -0,0 +1,180 @@
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+
+
+# Задача планировщика. Всё, что задаче нужно помнить между запусками,
+# хранится в state, а не в локальных переменных отдельного потока
+class Job:
+    __slots__ = (
+        "key",
+        "func",
+        "state",
+        "run_at",
+        "cancelled",
+        "running",
+        "pending",
+        "runs",
+    )
+
+    def __init__(self, key, func, state=None):
+        self.key = key
+        self.func = func
+        self.state = state
+        self.run_at = 0.0
+        self.cancelled = False
+        self.running = False
+        self.pending = None  # перенос, запрошенный во время выполнения
+        self.runs = 0
+
+
+class Scheduler:
+    """
+    Планировщик задач "выполнить не раньше run_at".
+    Очередь задач - min-heap по времени запуска, выполняет их
+    фиксированный пул рабочих потоков. Функция задачи получает объект Job
+    и возвращает задержку до следующего запуска в секундах
+    или None, если задача завершена.
+    """
+
+    def __init__(self, workers=4, name="scheduler"):
+        self.name = name
+        self.workers = workers
+        self._heap = []
+        self._jobs = {}  # key -> Job
+        self._seq = itertools.count()  # для стабильного порядка в heap
+        self._cond = threading.Condition()
+        self._ready = queue.Queue()
+        self._started = False
+        self._busy = 0
+        self._lateness = 0.0  # последняя задержка запуска относительно плана
+
+    def start(self):
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(
+            target=self._dispatch, name=f"{self.name}_dispatch", daemon=True
+        ).start()
+        for i in range(self.workers):
+            threading.Thread(
+                target=self._work, name=f"{self.name}_worker_{i}", daemon=True
+            ).start()
+
+    # Добавить задачу. Если задача с таким ключом уже есть - вернуть её
+    def schedule(self, key, func, delay=0, state=None):
+        with self._cond:
+            job = self._jobs.get(key)
+            if job is not None:
+                return job
+            job = Job(key, func, state)
+            self._jobs[key] = job
+            self._push(job, delay)
+            return job
+
+    # Перенести запуск задачи (например, запустить раньше плана)
+    def reschedule(self, key, delay):
+        with self._cond:
+            job = self._jobs.get(key)
+            if job is None:
+                return False
+            if job.running:
+                # Задача не должна выполняться в двух потоках сразу
+                if job.pending is None or delay < job.pending:
+                    job.pending = delay
+            else:
+                self._push(job, delay)
+            return True
+
+    def cancel(self, key):
+        with self._cond:
+            job = self._jobs.pop(key, None)
+            if job is not None:
+                job.cancelled = True
+            return job is not None
+
+    def get(self, key):
+        with self._cond:
+            return self._jobs.get(key)
+
+    def keys(self):
+        with self._cond:
+            return list(self._jobs)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._jobs)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "jobs": len(self._jobs),
+                "workers": self.workers,
+                "busy": self._busy,
+                "ready": self._ready.qsize(),
+                "lateness_sec": round(self._lateness, 3),
+            }
+
+    # Вызывается под self._cond
+    def _push(self, job, delay):
+        job.run_at = time.time() + max(delay, 0)
+        heapq.heappush(self._heap, (job.run_at, next(self._seq), job))
+        self._cond.notify()
+
+    # Поток-диспетчер: ждёт ближайшую задачу и передаёт её рабочим
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    run_at, _, job = self._heap[0]
+                    # Устаревшая запись: задача отменена или перенесена
+                    if job.cancelled or run_at != job.run_at:
+                        heapq.heappop(self._heap)
+                        continue
+                    wait = run_at - time.time()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                    heapq.heappop(self._heap)
+                    job.running = True
+                    self._lateness = -wait
+                    break
+            self._ready.put(job)
+
+    # Рабочий поток: выполняет задачу и планирует следующий запуск
+    def _work(self):
+        while True:
+            job = self._ready.get()
+            with self._cond:
+                self._busy += 1
+            try:
+                delay = job.func(job)
+            except Exception as e:
+                logging.error(
+                    f"Ошибка задачи {job.key} в {self.name}: {e}",
+                    exc_info=True,
+                )
+                delay = None
+            finally:
+                job.runs += 1
+                with self._cond:
+                    self._busy -= 1
+            with self._cond:
+                job.running = False
+                pending, job.pending = job.pending, None
+                if job.cancelled or self._jobs.get(job.key) is not job:
+                    continue
+                if delay is None:
+                    self._jobs.pop(job.key, None)
+                    job.cancelled = True
+                    continue
+                if pending is not None:
+                    delay = min(delay, pending)
+                self._push(job, delay)
@@ -0,0 +1,336 @@
+"""
+Схема БД бота и её версии (миграции).
+
+Таблица schema_version хранит применённые версии; migrate() применяет
+недостающие по порядку, каждую в своей транзакции. Таблицы и индексы
+создаются с IF NOT EXISTS, внешние ключи пересоздаются по найденным
+в pg_constraint: на базе, созданной до появления миграций, миграции
+ничего не ломают.
+
+check_hot_queries() выполняет EXPLAIN для запросов, которые бот делает
+постоянно (queries.py), с выключенным enable_seqscan: Seq Scan или проход
+по индексу без условия на его первую колонку значит, что нужного запросу
+индекса нет.
+
+Запуск:
+    python schema.py migrate
+    python schema.py check
+"""
+
+import json
+import logging
+import re
+import sys
+
+import queries
+
+# Ключ pg_advisory_xact_lock: миграции выполняет один процесс
+# (несколько воркеров gunicorn стартуют одновременно)
+MIGRATION_LOCK = 0x72776279
+
+# Пример URL маршрута для EXPLAIN
+URL = "https://pass.rw.by/"
+
+# (версия, описание, команды)
+MIGRATIONS = (
+    (
+        1,
+        "users, routes, trains, tracking",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                chat_id BIGINT PRIMARY KEY
+            )
+            """,
+            # date - строка YYYY-MM-DD (сравнивается и читается как текст)
+            """
+            CREATE TABLE IF NOT EXISTS routes (
+                route_id SERIAL PRIMARY KEY,
+                city_from TEXT NOT NULL,
+                city_to TEXT NOT NULL,
+                date TEXT NOT NULL,
+                url TEXT NOT NULL UNIQUE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS trains (
+                train_id SERIAL PRIMARY KEY,
+                route_id INTEGER NOT NULL REFERENCES routes (route_id),
+                train_number TEXT NOT NULL,
+                time_depart TEXT NOT NULL,
+                time_arriv TEXT NOT NULL,
+                UNIQUE (route_id, train_number, time_depart, time_arriv)
+            )
+            """,
+            # json_ticket_dict - вектор мест (seat_vector.encode_seats)
+            """
+            CREATE TABLE IF NOT EXISTS tracking (
+                tracking_id SERIAL PRIMARY KEY,
+                chat_id BIGINT NOT NULL REFERENCES users (chat_id),
+                train_id INTEGER NOT NULL REFERENCES trains (train_id),
+                json_ticket_dict TEXT,
+                UNIQUE (chat_id, train_id)
+            )
+            """,
+        ),
+    ),
+    (
+        2,
+        "индексы для поиска по train_id и дате маршрута",
+        (
+            # Уникальные ограничения покрывают routes.url,
+            # trains (route_id, train_number) и tracking (chat_id);
+            # JOIN tracking по train_id и очистке по дате нужны свои
+            """
+            CREATE INDEX IF NOT EXISTS tracking_train_id_idx
+            ON tracking (train_id)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS routes_date_idx ON routes (date)
+            """,
+        ),
+    ),
+    (
+        3,
+        "каскадное удаление поездов и отслеживаний вместе с маршрутом",
+        (
+            # Имена прежних внешних ключей заранее неизвестны (таблицы
+            # могли создаваться вручную) - ищутся в pg_constraint
+            """
+            DO $$
+            DECLARE fk RECORD;
+            BEGIN
+                FOR fk IN
+                    SELECT conrelid::regclass AS tbl, conname
+                    FROM pg_constraint
+                    WHERE contype = 'f'
+                    AND (
+                        (conrelid = 'trains'::regclass
+                         AND confrelid = 'routes'::regclass)
+                        OR (conrelid = 'tracking'::regclass
+                            AND confrelid = 'trains'::regclass)
+                    )
+                LOOP
+                    EXECUTE format(
+                        'ALTER TABLE %s DROP CONSTRAINT %I',
+                        fk.tbl, fk.conname
+                    );
+                END LOOP;
+            END $$
+            """,
+            """
+            ALTER TABLE trains ADD CONSTRAINT trains_route_id_fkey
+            FOREIGN KEY (route_id) REFERENCES routes (route_id)
+            ON DELETE CASCADE
+            """,
+            """
+            ALTER TABLE tracking ADD CONSTRAINT tracking_train_id_fkey
+            FOREIGN KEY (train_id) REFERENCES trains (train_id)
+            ON DELETE CASCADE
+            """,
+        ),
+    ),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+# С этой версии поезда и отслеживания удаляются вместе с маршрутом
+CASCADE_VERSION = 3
+
+# Запросы бота, выполняемые постоянно: (имя, запрос, пример параметров).
+# Имя - функция main.py, выполняющая запрос
+HOT_QUERIES = (
+    ("check_user_exists", queries.CHECK_USER_EXISTS, (1,)),
+    ("get_trains_list_db: route", queries.GET_ROUTE_ID, (URL,)),
+    ("get_trains_list_db: trains", queries.GET_ROUTE_TRAINS, (1,)),
+    ("get_train_id_db", queries.GET_TRAIN_ID, (URL, "000")),
+    ("get_tracking_status", queries.GET_TRACKING_STATUS, (1, 1, 1)),
+    ("get_track_list", queries.GET_TRACK_LIST, (1,)),
+    ("update_tracking_loop", queries.UPDATE_TRACKING, ("", 1, 1)),
+    ("get_all_active_trackings", queries.GET_ALL_ACTIVE_TRACKINGS, ()),
+    ("get_route_trackings", queries.GET_ROUTE_TRACKINGS, (URL,)),
+    ("del_tracking_db", queries.DELETE_TRACKING, (1, 1)),
+    ("_stop_tracking_logic", queries.DELETE_TRACKING_BY_ID, (1,)),
+    ("_confirm_stop_logic: tracking", queries.DELETE_USER_TRACKINGS, (1,)),
+    ("_confirm_stop_logic: user", queries.DELETE_USER, (1,)),
+    (
+        "_cleanup_logic: routes",
+        queries.SELECT_EXPIRED_ROUTES,
+        ("2000-01-01", 500),
+    ),
+    (
+        "_delete_routes_cascade: count",
+        queries.COUNT_ROUTES_DEPENDENTS,
+        ([1], [1]),
+    ),
+    ("_delete_routes_cascade: routes", queries.DELETE_ROUTES, ([1],)),
+    (
+        "_delete_routes_explicit: tracking",
+        queries.DELETE_ROUTES_TRACKING,
+        ([1],),
+    ),
+    ("_delete_routes_explicit: trains", queries.DELETE_ROUTES_TRAINS, ([1],)),
+    ("_delete_routes_explicit: routes", queries.DELETE_ROUTES, ([1],)),
+    # Каскадное удаление ищет дочерние строки по внешнему ключу
+    ("cascade_trains", "SELECT 1 FROM trains WHERE route_id = %s", (1,)),
+    ("cascade_tracking", "SELECT 1 FROM tracking WHERE train_id = %s", (1,)),
+)
+# Запросы, которым нужны все строки таблиц: полный проход не ошибка
+FULL_SCAN_QUERIES = frozenset({"get_all_active_trackings"})
+
+
+# Текущая версия схемы (0 - миграции ещё не применялись)
+def current_version(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """)
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+# Применённая версия схемы без изменений в БД
+# (0 - таблицы schema_version нет, миграции не применялись)
+def applied_version(cursor):
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+# Применить недостающие миграции. Возвращает список применённых версий
+def migrate(conn):
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK,)
+            )
+            if current_version(cursor) >= version:
+                conn.commit()
+                continue
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(
+                """
+                INSERT INTO schema_version (version, description)
+                VALUES (%s, %s)
+                """,
+                (version, description),
+            )
+        conn.commit()
+        applied.append(version)
+        logging.info(f"Схема БД: применена версия {version} ({description})")
+    return applied
+
+
+# Узлы плана, которыми планировщик при выключенном enable_seqscan
+# заменяет Seq Scan: полный проход по любому индексу таблицы
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+
+# Таблица индекса и его первая колонка (по ней индекс сужает поиск)
+def index_info(cursor, index_name):
+    cursor.execute(
+        """
+        SELECT i.indrelid::regclass::text, a.attname
+        FROM pg_index i
+        JOIN pg_attribute a
+        ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indexrelid = to_regclass(%s)
+        """,
+        (index_name,),
+    )
+    return cursor.fetchone() or (index_name, None)
+
+
+# Таблицы, которые план читает целиком: Seq Scan или проход по индексу
+# без условия на его первую колонку. index(имя) -> (таблица, колонка)
+def full_scans(plan, index):
+    found = []
+    node = plan.get("Node Type")
+    if node == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    elif node in INDEX_SCANS:
+        table, column = index(plan["Index Name"])
+        condition = plan.get("Index Cond", "")
+        if column is None or not re.search(
+            rf"(?<![\w.]){re.escape(column)}\b", condition
+        ):
+            found.append(table)
+    for child in plan.get("Plans", ()):
+        found.extend(full_scans(child, index))
+    return found
+
+
+# EXPLAIN горячих запросов: {имя: [таблицы, читаемые целиком]}
+# Запросы не выполняются; транзакция откатывается
+def check_hot_queries(conn):
+    report = {}
+    indexes = {}
+    with conn.cursor() as cursor:
+
+        def index(name):
+            if name not in indexes:
+                indexes[name] = index_info(cursor, name)
+            return indexes[name]
+
+        # Без этого на маленьких таблицах планировщик выбирает Seq Scan
+        # даже при наличии индекса
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        for name, query, params in HOT_QUERIES:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            report[name] = sorted(set(full_scans(plan[0]["Plan"], index)))
+    conn.rollback()
+    return report
+
+
+def _connect():
+    import psycopg2
+
+    from token_info import db_host, db_name, db_password, db_port, db_user
+
+    return psycopg2.connect(
+        dbname=db_name,
+        user=db_user,
+        password=db_password,
+        host=db_host,
+        port=db_port,
+    )
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "check"
+    if command not in ("migrate", "check"):
+        print(__doc__)
+        return 2
+    logging.basicConfig(level=logging.INFO)
+    conn = _connect()
+    try:
+        if command == "migrate":
+            applied = migrate(conn)
+            print(f"Применены версии: {applied or 'нет'}")
+            return 0
+        report = check_hot_queries(conn)
+    finally:
+        conn.close()
+    failed = 0
+    for name, tables in report.items():
+        status = f"full scan: {', '.join(tables)}" if tables else "ok"
+        if tables and name in FULL_SCAN_QUERIES:
+            status += " (ожидаемо: нужны все строки)"
+        else:
+            failed += bool(tables)
+        print(f"{name:<36} {status}")
+    # Код возврата 1, если какому-либо запросу не хватает индекса
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,108 @@
+import json
+
+# Классы вагонов по data-car-type (названия - только для сообщений)
+seats_type_dict = {
+    "0": "Без нумерации 🚶‍♂️",
+    "1": "Общий 🚃",
+    "2": "Сидячий 💺",
+    "3": "Плацкартный 🛏️",
+    "4": "Купейный 🚪🛏️",
+    "5": "Мягкий 🛋️",
+    "6": "СВ 👑",
+}
+CAR_TYPES = tuple(seats_type_dict)
+
+# Вектор мест - кортеж фиксированной длины 1 + len(CAR_TYPES):
+# (статус, места класса "0", ..., места класса "6")
+STATUS_SELLING = 0
+STATUS_SOLD_OUT = 1
+STATUS_NO_DATA = 2
+STATUS_TEXT = {
+    STATUS_SOLD_OUT: "Мест нет либо закрыта продажа",
+    STATUS_NO_DATA: "Ошибка получения информации о поезде",
+}
+# Ячейка класса: число мест либо
+ABSENT = -1  # класса нет в поезде
+UNNUMBERED = -2  # места без нумерации
+
+UNNUMBERED_TEXT = "∞"
+
+_EMPTY = (ABSENT,) * len(CAR_TYPES)
+_CAR_TYPE_BY_NAME = {
+    name: car_type for car_type, name in seats_type_dict.items()
+}
+
+
+def _status_vector(status):
+    return (status,) + _EMPTY
+
+
+# Вектор мест поезда по записи со страницы маршрута
+# (record = None - поезда на странице нет)
+def seat_vector(record):
+    if record is None or record.selling_allowed not in ("true", "false"):
+        return _status_vector(STATUS_NO_DATA)
+    if record.selling_allowed == "false":
+        return _status_vector(STATUS_SOLD_OUT)
+    cells = list(_EMPTY)
+    for car_type, seats in record.seats:
+        index = CAR_TYPES.index(car_type)
+        cells[index] = UNNUMBERED if seats is None else seats
+    return (STATUS_SELLING,) + tuple(cells)
+
+
+# Хранение в tracking.json_ticket_dict: JSON-массив вектора
+def encode_seats(vector):
+    return json.dumps(vector, separators=(",", ":"))
+
+
+# Вектор из tracking.json_ticket_dict. Понимает и прежний формат:
+# словарь {название класса: места} или строку статуса
+def decode_seats(stored):
+    if not stored:
+        return _status_vector(STATUS_NO_DATA)
+    value = json.loads(stored) if isinstance(stored, str) else stored
+    if isinstance(value, list):
+        return tuple(value)
+    if isinstance(value, str):
+        for status, text in STATUS_TEXT.items():
+            if value == text:
+                return _status_vector(status)
+        return _status_vector(STATUS_NO_DATA)
+    cells = list(_EMPTY)
+    for name, seats in value.items():
+        car_type = _CAR_TYPE_BY_NAME.get(name)
+        if car_type is None:
+            continue
+        index = CAR_TYPES.index(car_type)
+        cells[index] = seats if isinstance(seats, int) else UNNUMBERED
+    return (STATUS_SELLING,) + tuple(cells)
+
+
+# Текст для сообщения: места по названиям классов или статус продажи
+def format_seats(vector):
+    status = vector[0]
+    if status != STATUS_SELLING:
+        return STATUS_TEXT[status]
+    tickets_by_class = {}
+    for car_type, seats in zip(CAR_TYPES, vector[1:]):
+        if seats == ABSENT:
+            continue
+        name = seats_type_dict[car_type]
+        tickets_by_class[name] = UNNUMBERED_TEXT if seats < 0 else seats
+    return str(tickets_by_class)
+
+
+# Есть вагоны без нумерации мест
+def has_unnumbered(vector):
+    return vector[0] == STATUS_SELLING and vector[1] != ABSENT
+
+
+# Мест нет (продажа закрыта) или почти нет
+def is_scarce(vector):
+    if vector[0] != STATUS_SELLING:
+        return True
+    cells = [seats for seats in vector[1:] if seats != ABSENT]
+    if UNNUMBERED in cells:
+        return False
+    return sum(cells) <= 2
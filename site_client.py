@@ -0,0 +1,503 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+from token_info import (
+    breaker_cooldown,
+    breaker_failures,
+    breaker_half_open_trials,
+    breaker_max_cooldown,
+    http_connect_timeout,
+    http_pool_size,
+    http_read_timeout,
+    http_retries,
+    rate_limit_burst,
+    rate_limit_max,
+    rate_limit_min,
+    rate_limit_rps,
+    rate_limit_step,
+    rw_base_url,
+)
+
+
+# Класс ошибки для "Ошибка сайта"
+class SiteResponseError(Exception):
+    pass
+
+
+# Класс ошибки для "Сайт недоступен" (запрос не выполнялся)
+class CircuitOpenError(SiteResponseError):
+    def __init__(self, host, retry_after):
+        super().__init__(
+            f"Сайт {host} недоступен, повтор через {retry_after:.0f} сек"
+        )
+        self.host = host
+        self.retry_after = retry_after
+
+
+# Класс ошибки для "Слишком долгое ожидание очереди запросов к сайту"
+# (запрос не выполнялся)
+class RateLimitWaitError(SiteResponseError):
+    def __init__(self, retry_after):
+        super().__init__(
+            f"Очередь запросов к сайту: ожидание {retry_after:.0f} сек"
+        )
+        self.retry_after = retry_after
+
+
+# Заголовки как у браузера. Accept-Encoding - только те алгоритмы сжатия,
+# которые urllib3 умеет распаковать в этом окружении (br/zstd - при наличии
+# brotli/zstandard)
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"
+    + " AppleWebKit/537.36 (KHTML, like Gecko)"
+    + " Chrome/133.0.0.0 Safari/537.36",
+    "Accept": "*/*",
+    "Accept-Language": "en-GB,en-US;q=0.9,en;q=0.8,ru;q=0.7,it;q=0.6",
+    "Accept-Encoding": ACCEPT_ENCODING,
+}
+
+# (connect, read) таймауты в секундах
+TIMEOUT = (http_connect_timeout, http_read_timeout)
+
+# Размер куска при потоковом чтении тела ответа, байт
+STREAM_CHUNK_SIZE = 16 * 1024
+# Остаток тела после остановки разбора дочитывается (не разбирается), чтобы
+# keep-alive соединение вернулось в пул. Если остаток больше - соединение
+# закрывается
+STREAM_DRAIN_LIMIT = 256 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _build_session():
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    # Повторы только для ошибок соединения: запрос до сайта не дошёл.
+    # Ответы 5xx и обрывы чтения не повторяются здесь - их учитывают
+    # ограничитель частоты и предохранитель (каждый повтор - отдельный
+    # запрос к сайту, а Retry-After мог бы задержать поток на минуты)
+    retry = Retry(
+        total=http_retries,
+        connect=http_retries,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=0.5,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    # Один пул keep-alive соединений на хост (pass.rw.by)
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=http_pool_size,
+        max_retries=retry,
+        pool_block=True,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Общая для процесса сессия с пулом соединений
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+class AdaptiveRateLimiter:
+    """
+    Ограничитель частоты запросов к одному хосту (token bucket).
+    Скорость подстраивается по AIMD: каждый успешный ответ прибавляет
+    increase запросов/сек (до max_rate), ошибка ответа или таймаут
+    умножает скорость на decrease (не ниже min_rate).
+    reserve() сразу занимает место в очереди и возвращает, сколько секунд
+    ждать - так ограничитель работает и для потоков, и для asyncio.
+    С max_wait место занимается, только если ждать не дольше max_wait,
+    иначе - RateLimitWaitError (для запросов пользователя).
+    """
+
+    def __init__(
+        self,
+        rate,
+        min_rate,
+        max_rate,
+        burst=1,
+        increase=0.01,
+        decrease=0.5,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._decreases = 0
+        self._rejected = 0
+
+    # Вызывается под self._lock
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    # Занять токен. Возвращает задержку в секундах до разрешённого запроса
+    def reserve(self, max_wait=None):
+        with self._lock:
+            self._refill()
+            tokens = self._tokens - 1
+            wait = -tokens / self.rate if tokens < 0 else 0.0
+            if max_wait is not None and wait > max_wait:
+                self._rejected += 1
+                raise RateLimitWaitError(wait)
+            self._tokens = tokens
+            self._requests += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            return wait
+
+    # Вернуть занятый токен (запрос не выполнялся)
+    def release(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def acquire(self, max_wait=None):
+        wait = self.reserve(max_wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_success(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_failure(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._decreases += 1
+        logging.warning(f"Скорость запросов снижена до {self.rate:.3f}/сек")
+
+    def stats(self):
+        with self._lock:
+            self._refill()
+            requests_count = self._requests
+            return {
+                "rate": round(self.rate, 3),
+                # Запросы, уже получившие место в очереди и ждущие его
+                "queued": max(0, -int(self._tokens // 1)),
+                "requests": requests_count,
+                "avg_wait_sec": round(
+                    self._total_wait / requests_count if requests_count else 0,
+                    3,
+                ),
+                "max_wait_sec": round(self._max_wait, 3),
+                "rejected": self._rejected,
+                "decreases": self._decreases,
+            }
+
+
+class CircuitBreaker:
+    """
+    Предохранитель запросов к хосту.
+    closed - запросы идут; после failure_threshold сбоев подряд - open:
+    запросы сразу завершаются CircuitOpenError без обращения к сети.
+    Через cooldown секунд - half_open: пропускается half_open_trials
+    пробных запросов. Успех закрывает предохранитель, сбой снова открывает
+    его с удвоенным (до max_cooldown) временем ожидания.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        host,
+        failure_threshold=5,
+        cooldown=60,
+        max_cooldown=1800,
+        half_open_trials=1,
+    ):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.half_open_trials = half_open_trials
+        self.state = self.CLOSED
+        self._cooldown = cooldown
+        self._failures = 0
+        self._opened_until = 0.0
+        self._trials = 0
+        self._opened_count = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    # Разрешение на запрос. Если предохранитель открыт - CircuitOpenError
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now < self._opened_until:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.host, self._opened_until - now)
+                self.state = self.HALF_OPEN
+                self._trials = 0
+                logging.info(f"Предохранитель {self.host}: пробный запрос")
+            if self.state == self.HALF_OPEN:
+                if self._trials >= self.half_open_trials:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.host, self.base_cooldown)
+                self._trials += 1
+
+    def on_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info(f"Предохранитель {self.host} закрыт")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._cooldown = self.base_cooldown
+
+    def on_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN:
+                self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+                self._open()
+            elif (
+                self.state == self.CLOSED
+                and self._failures >= self.failure_threshold
+            ):
+                self._open()
+
+    # Вызывается под self._lock
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_until = time.monotonic() + self._cooldown
+        self._opened_count += 1
+        logging.warning(
+            f"Предохранитель {self.host} открыт на {self._cooldown:.0f} сек "
+            f"после {self._failures} сбоев подряд"
+        )
+
+    # Сколько секунд сайт считается недоступным (None - предохранитель закрыт)
+    def retry_after(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return None
+            return max(0.0, self._opened_until - time.monotonic())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self._failures,
+                "cooldown_sec": self._cooldown,
+                "opened": self._opened_count,
+                "rejected": self._rejected,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_breakers = {}
+
+
+# Ограничитель частоты запросов для хоста из url
+def get_limiter(url):
+    host = urlsplit(url).netloc.lower()
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter(
+                rate=rate_limit_rps,
+                min_rate=rate_limit_min,
+                max_rate=rate_limit_max,
+                burst=rate_limit_burst,
+                increase=rate_limit_step,
+            )
+            _limiters[host] = limiter
+        return limiter
+
+
+def limiter_stats():
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {host: limiter.stats() for host, limiter in limiters.items()}
+
+
+# Предохранитель для хоста из url
+def get_breaker(url):
+    host = urlsplit(url).netloc.lower()
+    with _limiters_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                host,
+                failure_threshold=breaker_failures,
+                cooldown=breaker_cooldown,
+                max_cooldown=breaker_max_cooldown,
+                half_open_trials=breaker_half_open_trials,
+            )
+            _breakers[host] = breaker
+        return breaker
+
+
+def breaker_stats():
+    with _limiters_lock:
+        breakers = dict(_breakers)
+    return {host: breaker.stats() for host, breaker in breakers.items()}
+
+
+# Сколько секунд сайт недоступен по мнению предохранителя
+# (None - сайт доступен, сбои надо учитывать как обычно)
+def outage_retry_after(url):
+    return get_breaker(url).retry_after()
+
+
+# Учесть результат запроса: 200/304 - успех, иначе сбой
+def report_response(url, status_code):
+    if status_code in (200, 304):
+        get_limiter(url).on_success()
+        get_breaker(url).on_success()
+    else:
+        report_failure(url)
+
+
+# Учесть сбой запроса (код ответа, таймаут, обрыв соединения)
+def report_failure(url):
+    get_limiter(url).on_failure()
+    get_breaker(url).on_failure()
+
+
+# URL страницы маршрута. Базовый адрес настраивается (RW_BASE_URL),
+# например, для локального сервера tools/fake_rw_server.py
+def route_url(city_from, city_to, date, base_url=None):
+    base_url = (base_url or rw_base_url).rstrip("/")
+    return (
+        f"{base_url}/ru/route/?from={quote(city_from)}"
+        f"&to={quote(city_to)}&date={date}"
+    )
+
+
+# Заголовки запроса страницы маршрута.
+# С X-Requested-With сайт всё равно отдаёт HTML-страницу: отдельного
+# JSON-ответа со списком поездов маршрута нет (см. readme.txt)
+def route_headers(url):
+    headers = dict(DEFAULT_HEADERS)
+    headers["Referer"] = url
+    headers["X-Requested-With"] = "XMLHttpRequest"
+    return headers
+
+
+# GET-запрос через предохранитель, ограничитель частоты
+# и общий пул с таймаутами и повторами.
+# on_chunk(bytes) - тело читается потоком, каждый кусок сразу передаётся
+# в on_chunk (например, в парсер); r.content после этого тоже доступен.
+# Если on_chunk вернул True, остаток тела в on_chunk не передаётся
+# и в r.content не попадает (r.content - начало), а только дочитывается
+# (до STREAM_DRAIN_LIMIT), чтобы не терять keep-alive соединение.
+# max_wait - предельное ожидание очереди запросов (RateLimitWaitError)
+def fetch(url, headers=None, on_chunk=None, max_wait=None):
+    # Место в очереди занимается до проверки предохранителя: отказ
+    # по max_wait не должен расходовать пробный запрос half_open
+    limiter = get_limiter(url)
+    wait = limiter.reserve(max_wait)
+    try:
+        get_breaker(url).allow()
+    except CircuitOpenError:
+        limiter.release()
+        raise
+    if wait > 0:
+        time.sleep(wait)
+    try:
+        r = get_session().get(
+            url, headers=headers, timeout=TIMEOUT, stream=on_chunk is not None
+        )
+        if on_chunk is not None:
+            with r:
+                chunks = []
+                drained = None  # байт дочитано после остановки
+                for chunk in r.iter_content(STREAM_CHUNK_SIZE):
+                    if drained is not None:
+                        drained += len(chunk)
+                        if drained > STREAM_DRAIN_LIMIT:
+                            break
+                        continue
+                    chunks.append(chunk)
+                    if on_chunk(chunk):
+                        drained = 0
+                # Тело уже прочитано: то же, что requests делает в r.content
+                r._content = b"".join(chunks)
+    except Exception:
+        report_failure(url)
+        raise
+    report_response(url, r.status_code)
+    return r
+
+
+# Проверка кода ответа сайта (в т.ч. для ответов, полученных не через fetch)
+def check_route_response(url, status_code, text):
+    if status_code != 200:
+        if isinstance(text, (bytes, bytearray)):
+            text = text[:500].decode("utf-8", "replace")
+        logging.warning(
+            f"Fail response. Code {status_code}, route {url}\n"
+            f"Ответ при ошибке {text[:500]}"
+        )
+        raise SiteResponseError(f"Ошибка ответа сайта. Код {status_code}")
+
+
+# Валидаторы для условного запроса по заголовкам прошлого ответа
+def conditional_headers(etag=None, last_modified=None):
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+# Изменчивые части страницы, не влияющие на наличие мест:
+# скрипты (токены, метки времени) и data-value (обратный отсчёт секунд
+# до отправления меняется при каждом запросе)
+_SCRIPT_RE = re.compile(rb"<script\b.*?</script>", re.S | re.I)
+_DATA_VALUE_RE = re.compile(rb'\sdata-value="[^"]*"')
+_SPACES_RE = re.compile(rb"\s+")
+
+
+# Отпечаток таблицы поездов (sch-table) страницы маршрута.
+# Совпадение отпечатков означает, что разбирать страницу заново не нужно.
+# Считается по байтам ответа, без декодирования (строка кодируется в UTF-8)
+def page_fingerprint(body):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    start = body.find(b"sch-table")
+    region = body[start:] if start != -1 else body
+    region = _SCRIPT_RE.sub(b"", region)
+    region = _DATA_VALUE_RE.sub(b"", region)
+    region = _SPACES_RE.sub(b" ", region)
+    return hashlib.blake2b(region, digest_size=16).hexdigest()
@@ -14,4 +14,87 @@ db_host = os.getenv("DB_HOST")
 db_port = os.getenv("DB_PORT") 
 db_name = os.getenv("DB_NAME") 
 webhook_url = os.getenv("WEBHOOK_URL")
-web_port = int(os.getenv("WEB_PORT", 8080))
\ No newline at end of file
+web_port = int(os.getenv("WEB_PORT", 8080))
+
+# Число рабочих потоков планировщика отслеживаний
+tracking_workers = int(os.getenv("TRACKING_WORKERS", 4))
+
+# Движок отслеживания: threads | async | mixed (оба движка, маршруты делятся)
+tracking_engine = os.getenv("TRACKING_ENGINE", "threads")
+# Доля маршрутов (%) для async-движка в режиме mixed
+async_engine_share = int(os.getenv("ASYNC_ENGINE_SHARE", 50))
+# Максимум одновременных запросов на сайт у async-движка
+async_engine_concurrency = int(os.getenv("ASYNC_ENGINE_CONCURRENCY", 50))
+
+# Базовый адрес сайта (для тестов - локальный tools/fake_rw_server.py)
+rw_base_url = os.getenv("RW_BASE_URL", "https://pass.rw.by")
+
+# HTTP-клиент для pass.rw.by: размер пула соединений, таймауты (сек),
+# повторы при ошибке соединения (ответы 5xx не повторяются)
+http_pool_size = int(os.getenv("HTTP_POOL_SIZE", 10))
+http_connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+http_read_timeout = float(os.getenv("HTTP_READ_TIMEOUT", 20))
+http_retries = int(os.getenv("HTTP_RETRIES", 2))
+
+# Кэш страниц маршрутов: время свежести (сек) и максимум страниц
+route_cache_ttl = float(os.getenv("ROUTE_CACHE_TTL", 60))
+route_cache_size = int(os.getenv("ROUTE_CACHE_SIZE", 256))
+
+# Ограничитель частоты запросов к pass.rw.by (запросов/сек): начальная,
+# минимальная и максимальная скорость, пачка, прирост после успешного ответа
+rate_limit_rps = float(os.getenv("RATE_LIMIT_RPS", 1))
+rate_limit_min = float(os.getenv("RATE_LIMIT_MIN", 0.05))
+rate_limit_max = float(os.getenv("RATE_LIMIT_MAX", 2))
+rate_limit_burst = int(os.getenv("RATE_LIMIT_BURST", 5))
+rate_limit_step = float(os.getenv("RATE_LIMIT_STEP", 0.01))
+# Сколько секунд запрос пользователя (поиск, выбор поезда) может ждать
+# очереди запросов к сайту; дольше - устаревшая страница из кэша или отказ
+rate_limit_user_max_wait = float(os.getenv("RATE_LIMIT_USER_MAX_WAIT", 5))
+
+# Предохранитель запросов к сайту: сбоев подряд до открытия, время ожидания
+# (сек) и его максимум, число пробных запросов после ожидания
+breaker_failures = int(os.getenv("BREAKER_FAILURES", 5))
+breaker_cooldown = float(os.getenv("BREAKER_COOLDOWN", 60))
+breaker_max_cooldown = float(os.getenv("BREAKER_MAX_COOLDOWN", 1800))
+breaker_half_open_trials = int(os.getenv("BREAKER_HALF_OPEN_TRIALS", 1))
+
+# Политика опроса маршрутов: границы интервала (сек) и общий бюджет
+# запросов к сайту в минуту для всех отслеживаний
+poll_min_interval = float(os.getenv("POLL_MIN_INTERVAL", 120))
+poll_max_interval = float(os.getenv("POLL_MAX_INTERVAL", 3600))
+poll_budget_per_minute = float(os.getenv("POLL_BUDGET_PER_MINUTE", 30))
+
+# Разбор страниц маршрутов: lxml (XPath, быстрый) | bs4 (BeautifulSoup,
+# эталонная реализация для проверки совпадения результатов)
+parser_backend = os.getenv("PARSER_BACKEND", "lxml")
+
+# Опрос отслеживаний: разбирать страницу только до строк отслеживаемых
+# поездов (1 - да; остаток тела всё равно дочитывается ради keep-alive,
+# экономится только разбор). По умолчанию 0 - страница разбирается целиком
+stream_stop_early = os.getenv("STREAM_STOP_EARLY", "0") == "1"
+
+# Разбор страниц в отдельных процессах: число процессов (0 - в потоке,
+# получившем страницу) и время разбора одной страницы, после которого
+# пишется предупреждение, сек
+parse_processes = int(os.getenv("PARSE_PROCESSES", 0))
+parse_timeout = float(os.getenv("PARSE_TIMEOUT", 10))
+
+# Пул соединений с БД: минимум и максимум соединений, ожидание свободного
+# соединения (сек), время жизни соединения (сек) и простой, после которого
+# соединение проверяется запросом SELECT 1 перед выдачей (сек)
+db_pool_min = int(os.getenv("DB_POOL_MIN", 1))
+db_pool_max = int(os.getenv("DB_POOL_MAX", 10))
+db_pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", 30))
+db_conn_max_age = float(os.getenv("DB_CONN_MAX_AGE", 3600))
+db_conn_check_idle = float(os.getenv("DB_CONN_CHECK_IDLE", 60))
+
+# Обращения к БД: число потоков (не больше DB_POOL_MAX) и предельное
+# время ожидания результата одного обращения, сек
+db_workers = int(os.getenv("DB_WORKERS", 4))
+db_call_timeout = float(os.getenv("DB_CALL_TIMEOUT", 60))
+
+# Применять миграции схемы БД (schema.py) при запуске: 1 - да, 0 - нет
+db_migrate = os.getenv("DB_MIGRATE", "1") == "1"
+
+# Очистка прошедших маршрутов: число маршрутов, удаляемых одной транзакцией
+cleanup_batch_size = int(os.getenv("CLEANUP_BATCH_SIZE", 500))
@@ -0,0 +1,234 @@
+"""
+Бенчмарк разбора страниц маршрутов на корпусе fixtures/routes.
+
+Для каждой страницы и каждой реализации разбора измеряет задержку
+(p50/p90/p99), пропускную способность (страниц и поездов в секунду),
+пиковую память (прирост пикового RSS в отдельном процессе:
+tracemalloc не видит память libxml2) и совпадение результата с эталоном (bs4).
+Реализация legacy - прежний путь: BeautifulSoup и CSS-селекторы
+для каждого поезда.
+
+Запуск:
+    python -m tools.bench_parsers --repeat 50
+    python -m tools.bench_parsers --backend lxml --backend bs4 --json out.json
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import time
+from pathlib import Path
+
+from route_parser import (
+    PARSER_BACKENDS,
+    SEATS_CLASS,
+    TrainRecord,
+    parse_route_soup,
+)
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent.parent / "fixtures" / "routes"
+REFERENCE = "bs4"
+
+
+def _select_text(soup, selector):
+    found = soup.select(selector)
+    return found[0].text.strip() if found else "Нет данных"
+
+
+# Прежний разбор: отдельные CSS-селекторы по всему документу для каждого
+# поезда (get_trains_list, check_tickets_by_class, check_depart_time)
+def parse_legacy(text):
+    soup = parse_route_soup(text)
+    trains = {}
+    for span in soup.find_all("span", class_="train-number"):
+        train = span.text
+        prefix = f'[data-train-number^="{train}"]'
+        time_depart = _select_text(soup, f'{prefix} [data-sort="departure"]')
+        time_arriv = _select_text(soup, f'{prefix} [data-sort="arrival"]')
+        rows = soup.select(f"div.sch-table__row{prefix}")
+        selling_allowed = "none"
+        seats = {}
+        if rows:
+            selling_allowed = rows[0].get(
+                "data-ticket_selling_allowed", "none"
+            )
+            for cell in rows[0].find_all(class_=SEATS_CLASS):
+                try:
+                    count = int(cell.select_one("span").text)
+                except (AttributeError, ValueError):
+                    seats[cell["data-car-type"]] = None
+                    continue
+                car_type = cell["data-car-type"]
+                if seats.get(car_type, 0) is not None:
+                    seats[car_type] = seats.get(car_type, 0) + count
+        from_time = soup.select(
+            f"div.sch-table__row{prefix} div.sch-table__time.train-from-time"
+        )
+        try:
+            seconds_to_depart = int(from_time[0]["data-value"])
+        except (IndexError, KeyError, ValueError):
+            seconds_to_depart = None
+        trains.setdefault(
+            train,
+            TrainRecord(
+                train,
+                time_depart,
+                time_arriv,
+                selling_allowed,
+                tuple(seats.items()),
+                seconds_to_depart,
+            ),
+        )
+    return trains
+
+
+def all_backends():
+    backends = dict(PARSER_BACKENDS)
+    backends["legacy"] = parse_legacy
+    return backends
+
+
+def load_corpus(path):
+    path = Path(path)
+    index = json.loads((path / "index.json").read_text("utf-8"))
+    return [
+        (entry["file"], (path / entry["file"]).read_text("utf-8"))
+        for entry in index
+    ]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * q / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+# Пиковый RSS текущего процесса (VmHWM), KiB. ru_maxrss не подходит:
+# после fork + exec он не меньше RSS родителя
+def peak_rss_kib():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+# Прирост пикового RSS процесса за один разбор, байт
+# (выполняется в дочернем процессе, результат - в conn)
+def _measure_peak(name, text, conn):
+    parse = all_backends()[name]
+    # Ленивые импорты и инициализация разбора - до замера
+    parse("<html><body></body></html>")
+    gc.collect()
+    before = peak_rss_kib()
+    parse(text)
+    conn.send((peak_rss_kib() - before) * 1024)
+    conn.close()
+
+
+# Пиковая память одного разбора, байт. Новый процесс (spawn): в текущем
+# освобождённая память прошлых разборов уже в RSS и скрыла бы прирост
+def peak_memory(name, text):
+    ctx = multiprocessing.get_context("spawn")
+    reader, writer = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_measure_peak, args=(name, text, writer))
+    process.start()
+    writer.close()
+    try:
+        return reader.recv()
+    finally:
+        process.join()
+
+
+def bench_page(name, parse, text, repeat, warmup):
+    for _ in range(warmup):
+        parse(text)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        trains = parse(text)
+        timings.append(time.perf_counter() - start)
+    total = sum(timings)
+    return {
+        "backend": name,
+        "trains": len(trains),
+        "p50_ms": percentile(timings, 50) * 1000,
+        "p90_ms": percentile(timings, 90) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+        "pages_per_sec": repeat / total if total else 0.0,
+        "trains_per_sec": repeat * len(trains) / total if total else 0.0,
+        "peak_kib": peak_memory(name, text) / 1024,
+    }
+
+
+# Сравнение результата с эталоном: число расходящихся поездов
+def count_differences(result, reference):
+    numbers = set(result) | set(reference)
+    return sum(1 for n in numbers if result.get(n) != reference.get(n))
+
+
+def run(corpus, backends, repeat=20, warmup=2):
+    available = all_backends()
+    report = []
+    for file_name, text in load_corpus(corpus):
+        reference = available[REFERENCE](text)
+        for name in backends:
+            parse = available[name]
+            row = bench_page(name, parse, text, repeat, warmup)
+            row["page"] = file_name
+            row["size_kib"] = len(text.encode("utf-8")) / 1024
+            row["differences"] = count_differences(parse(text), reference)
+            report.append(row)
+    return report
+
+
+def print_report(report):
+    header = (
+        f"{'page':<28} {'backend':<8} {'trains':>6} {'p50 ms':>8} "
+        f"{'p90 ms':>8} {'p99 ms':>8} {'pages/s':>9} {'trains/s':>10} "
+        f"{'peak KiB':>9} {'diff':>5}"
+    )
+    print(header)
+    print("-" * len(header))
+    for row in report:
+        print(
+            f"{row['page']:<28} {row['backend']:<8} {row['trains']:>6} "
+            f"{row['p50_ms']:>8.2f} {row['p90_ms']:>8.2f} "
+            f"{row['p99_ms']:>8.2f} {row['pages_per_sec']:>9.1f} "
+            f"{row['trains_per_sec']:>10.0f} {row['peak_kib']:>9.0f} "
+            f"{row['differences']:>5}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS))
+    parser.add_argument(
+        "--backend",
+        action="append",
+        choices=sorted(all_backends()),
+        help="реализация разбора (можно несколько, по умолчанию все)",
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    args = parser.parse_args(argv)
+
+    backends = args.backend or sorted(all_backends())
+    report = run(args.corpus, backends, args.repeat, args.warmup)
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps(report, ensure_ascii=False, indent=2) + "\n", "utf-8"
+        )
+    # Код возврата 1, если какая-либо реализация расходится с эталоном
+    return 1 if any(row["differences"] for row in report) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
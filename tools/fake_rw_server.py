@@ -0,0 +1,233 @@
+"""
+Локальная замена pass.rw.by для нагрузочных тестов и бенчмарков.
+
+Отдаёт записанные страницы маршрутов из корпуса fixtures/routes
+по адресу /ru/route/?from=&to=&date= и умеет имитировать проблемы сайта:
+задержки, ответы 5xx, обрезанные страницы и изменение числа мест со временем.
+
+Запуск:
+    python -m tools.fake_rw_server --port 8765 --latency 0.3 --error-rate 0.05
+Бот на него переключается через RW_BASE_URL=http://127.0.0.1:8765
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent.parent / "fixtures" / "routes"
+
+# Число мест внутри ячейки класса вагона
+SEATS_RE = re.compile(r'(data-car-type="\d"><span>)(\d+)(</span>)')
+# Секунды до отправления (обратный отсчёт)
+DATA_VALUE_RE = re.compile(
+    r'(train-(?:from|to)-time"[^>]*data-value=")(-?\d+)'
+)
+
+
+# Корпус страниц: index.json со списком {"file", "from", "to", ...}
+class Corpus:
+    def __init__(self, path):
+        self.path = Path(path)
+        index = json.loads((self.path / "index.json").read_text("utf-8"))
+        self.entries = []
+        for entry in index:
+            body = (self.path / entry["file"]).read_text("utf-8")
+            self.entries.append((entry, body))
+        if not self.entries:
+            raise ValueError(f"Пустой корпус страниц: {self.path}")
+
+    # Страница для маршрута: точное совпадение станций или любая по хешу,
+    # чтобы сервер отвечал на любые маршруты
+    def find(self, city_from, city_to):
+        for entry, body in self.entries:
+            if entry.get("from") == city_from and entry.get("to") == city_to:
+                return entry, body
+        key = f"{city_from}|{city_to}".encode()
+        index = int(hashlib.md5(key).hexdigest(), 16) % len(self.entries)
+        return self.entries[index]
+
+
+class FakeSite:
+    def __init__(self, corpus, options):
+        self.corpus = corpus
+        self.options = options
+        self.started = time.time()
+        self.rng = random.Random(options.seed)
+        self.rng_lock = threading.Lock()
+        self.requests = 0
+
+    def chance(self, probability):
+        with self.rng_lock:
+            return self.rng.random() < probability
+
+    # Тело страницы на текущий момент: отсчёт до отправления идёт,
+    # число мест меняется раз в seat_change_interval секунд
+    def render(self, entry, body):
+        elapsed = int(time.time() - self.started)
+        body = DATA_VALUE_RE.sub(
+            lambda m: f"{m.group(1)}{int(m.group(2)) - elapsed}", body
+        )
+        interval = self.options.seat_change_interval
+        if interval > 0:
+            epoch = elapsed // interval
+            counter = iter(range(10**6))
+
+            def change(m):
+                # Детерминированно для (страница, ячейка, период)
+                rng = random.Random(
+                    f"{self.options.seed}:{entry['file']}:"
+                    f"{next(counter)}:{epoch}"
+                )
+                seats = max(0, int(m.group(2)) + rng.randint(-3, 2))
+                return f"{m.group(1)}{seats}{m.group(3)}"
+
+            body = SEATS_RE.sub(change, body)
+        return body
+
+
+def make_handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+        def do_GET(self):
+            site.requests += 1
+            parts = urlsplit(self.path)
+            if parts.path == "/health":
+                return self.send_body(200, b"ok", "text/plain")
+            if parts.path.rstrip("/") != "/ru/route":
+                return self.send_body(404, b"not found", "text/plain")
+
+            options = site.options
+            if options.latency > 0 or options.jitter > 0:
+                time.sleep(
+                    max(
+                        0.0,
+                        options.latency + random.uniform(0, options.jitter),
+                    )
+                )
+            if site.chance(options.error_rate):
+                return self.send_body(
+                    503, b"<html>Service Unavailable</html>", "text/html"
+                )
+
+            query = parse_qs(parts.query)
+            entry, body = site.corpus.find(
+                query.get("from", [""])[0], query.get("to", [""])[0]
+            )
+            data = site.render(entry, body).encode("utf-8")
+
+            etag = '"' + hashlib.md5(data).hexdigest() + '"'
+            if options.etag and self.headers.get("If-None-Match") == etag:
+                return self.send_body(304, b"", None, {"ETag": etag})
+
+            if site.chance(options.truncate_rate):
+                cut = random.randint(len(data) // 10, len(data) // 2)
+                if options.truncate_mode == "connection":
+                    # Заявленная длина больше отправленной, соединение рвётся
+                    self.send_response(200)
+                    self.send_header(
+                        "Content-Type", "text/html; charset=utf-8"
+                    )
+                    self.send_header("Content-Length", str(len(data)))
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    self.wfile.write(data[:cut])
+                    self.close_connection = True
+                    return
+                data = data[:cut]
+
+            extra = {"ETag": etag} if options.etag else {}
+            return self.send_body(200, data, "text/html; charset=utf-8", extra)
+
+        def send_body(self, status, data, content_type, extra_headers=None):
+            self.send_response(status)
+            if content_type:
+                self.send_header("Content-Type", content_type)
+            for name, value in (extra_headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if data:
+                self.wfile.write(data)
+
+    return Handler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS))
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="задержка ответа, сек"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="случайная добавка, сек"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="доля ответов 503"
+    )
+    parser.add_argument(
+        "--truncate-rate",
+        type=float,
+        default=0.0,
+        help="доля обрезанных страниц",
+    )
+    parser.add_argument(
+        "--truncate-mode",
+        choices=["body", "connection"],
+        default="body",
+        help="body - короткая страница с кодом 200, "
+        "connection - обрыв соединения посреди ответа",
+    )
+    parser.add_argument(
+        "--seat-change-interval",
+        type=int,
+        default=0,
+        help="раз в сколько секунд меняется число мест (0 - никогда)",
+    )
+    parser.add_argument(
+        "--etag", action="store_true", help="отдавать ETag и 304"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def make_server(options):
+    site = FakeSite(Corpus(options.corpus), options)
+    server = ThreadingHTTPServer(
+        (options.host, options.port), make_handler(site)
+    )
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    options = parse_args(argv)
+    server = make_server(options)
+    logging.info(
+        f"Fake pass.rw.by: http://{options.host}:{server.server_port} "
+        f"(корпус {options.corpus})"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Запись страницы маршрута с сайта в корпус fixtures/routes.
+
+Страница обезличивается: удаляются скрипты, CSRF-токены, скрытые поля форм,
+адреса почты и телефоны, блоки пользователя. В index.json добавляется запись
+с маршрутом и числом поездов.
+
+Запуск:
+    python -m tools.record_route_page --from "Минск-Пассажирский" \\
+        --to "Брест-Центральный" --date 2025-09-01 --name minsk_brest
+"""
+
+import argparse
+import json
+import re
+from pathlib import Path
+
+from route_parser import parse_route_page
+from site_client import fetch, route_headers, route_url
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent.parent / "fixtures" / "routes"
+
+# (шаблон, замена) для обезличивания
+ANONYMIZE_RULES = [
+    (re.compile(r"<script\b.*?</script>", re.S | re.I), ""),
+    (re.compile(r"<noscript\b.*?</noscript>", re.S | re.I), ""),
+    (re.compile(r"<iframe\b.*?</iframe>", re.S | re.I), ""),
+    (re.compile(r'<meta[^>]+name="csrf[^"]*"[^>]*>', re.I), ""),
+    (re.compile(r'<input[^>]+type="hidden"[^>]*>', re.I), ""),
+    (re.compile(r'\s(?:data-user[\w-]*|data-token|data-session)="[^"]*"'), ""),
+    (
+        re.compile(
+            r'<div[^>]+class="[^"]*\b(?:user|profile|account)[\w-]*"'
+            r".*?</div>",
+            re.S | re.I,
+        ),
+        "",
+    ),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "user@example.com"),
+    (re.compile(r"\+?375[\s(-]*\d{2}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}"), ""),
+]
+
+
+def anonymize(html):
+    for pattern, replacement in ANONYMIZE_RULES:
+        html = pattern.sub(replacement, html)
+    return html
+
+
+def record(city_from, city_to, date, name, corpus=DEFAULT_CORPUS):
+    corpus = Path(corpus)
+    url = route_url(city_from, city_to, date)
+    r = fetch(url, headers=route_headers(url))
+    r.raise_for_status()
+    # Страницы сайта в UTF-8, даже если в заголовках кодировка не указана
+    r.encoding = "utf-8"
+    html = anonymize(r.text)
+
+    file_name = f"{name}.html"
+    (corpus / file_name).write_text(html, "utf-8")
+
+    index_path = corpus / "index.json"
+    index = json.loads(index_path.read_text("utf-8"))
+    index = [entry for entry in index if entry["file"] != file_name]
+    index.append(
+        {
+            "file": file_name,
+            "from": city_from,
+            "to": city_to,
+            "date": str(date),
+            "trains": len(parse_route_page(html)),
+            "synthetic": False,
+        }
+    )
+    index_path.write_text(
+        json.dumps(index, ensure_ascii=False, indent=2) + "\n", "utf-8"
+    )
+    return corpus / file_name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--from", dest="city_from", required=True)
+    parser.add_argument("--to", dest="city_to", required=True)
+    parser.add_argument("--date", required=True, help="ГГГГ-ММ-ДД")
+    parser.add_argument("--name", required=True, help="имя файла без .html")
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS))
+    args = parser.parse_args(argv)
+    path = record(
+        args.city_from, args.city_to, args.date, args.name, args.corpus
+    )
+    print(f"Записано: {path}")
+
+
+if __name__ == "__main__":
+    main()